@@ -3,16 +3,94 @@
 
 
 import sys
+import shlex
+import timeit
 import argparse
+import threading
 import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from functools import wraps
 
+# other jelly modules
+from structure import Structure
+
 import logging
 # We are assuming, that there is an already configured logger present
 logger = logging.getLogger(__name__)
 
 
+class CommandLineError(Exception):
+    """Some actions of a parallel run have failed"""
+
+    def __init__(self, errors):
+        """
+        @type  errors: list
+        @param errors: (action name, exception) for every failed action
+        """
+        Exception.__init__(self, "\n".join("--{}: {!r}".format(name, error) for name, error in errors))
+        self.errors = errors
+
+
+class ScriptArgumentParser(argparse.ArgumentParser):
+    """Argument parser for script lines, raising errors instead of exiting.
+    It has no help argument."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("add_help", False)
+        argparse.ArgumentParser.__init__(self, *args, **kwargs)
+
+    def error(self, message):
+        raise ValueError(message)
+
+    def exit(self, status=0, message=None):
+        raise ValueError(message.strip() if message else "exit with status {}".format(status))
+
+
+class CommandResult(Structure):
+    """The result of a script line"""
+    __slots__ = ['line', 'command', 'status', 'seconds', 'error']
+
+
+_worker = None
+"""The state of a worker process of a pool, set by `_initWorker`"""
+
+
+def _initWorker(state):
+    """Initialize a worker process of a pool. The state is inherited by
+    the fork, it is not pickled."""
+    global _worker
+    _worker = state
+
+
+def _callInWorker(index):
+    """Run an action inside a worker process"""
+    core, arg, params = _worker[index]
+    return CommandLine.call(core, arg, params)
+
+
+def _mapInWorker(item):
+    """Run a mapped action on a single input inside a worker process"""
+    core, arg = _worker
+    return getattr(core, arg.method)(item)
+
+
+def _canFork():
+    """Forking is only safe on the main thread, a fork of another thread may
+    inherit locks held by the threads, that don't exist in the child."""
+    return sys.platform != "win32" and isinstance(threading.current_thread(), threading._MainThread)
+
+
+def _progress(stream, done, total, width=40):
+    """Draw a progress bar"""
+    filled = width * done // total if total > 0 else width
+    stream.write("\r[{}{}] {}/{}".format("#" * filled, " " * (width - filled), done, total))
+    if done >= total:
+        stream.write("\n")
+    stream.flush()
+
+
 class CommandLine(object):
     """Create a command line interface for the application.
     Can call any core method as action.
@@ -24,19 +102,55 @@ class CommandLine(object):
     arguments = collections.OrderedDict()
 
     @classmethod
-    def handle(self, core, name):
+    def handle(self, core, name, argv=None):
         """Handle the command line arguments.
         Returns true if the gui is to be shown, this is controlled
-        through the 'batch' argument."""
+        through the 'batch', 'script' and 'serve' arguments.
+
+        With the 'parallel' argument, the actions of the same weight
+        declared as *parallel_safe* run at the same time.
+
+        With the 'script' argument, the actions of every line of a file
+        are run afterwards (see `runScript`).
+
+        With the 'serve' argument, the core keeps serving actions through
+        a UNIX socket (see `server`)."""
+        arg_parser, call_buckets = self.buildParser(name)
+        # Parse all arguments
+        args = arg_parser.parse_args(argv)
+        if len(args.set) > 0:
+            if getattr(core, "preferences", None) is not None:
+                core.preferences.loadArguments(args.set)
+            else:
+                logger.warning("The core has no preferences to override")
+        self.execute(core, args, arg_parser, call_buckets)
+        if args.script is not None:
+            if args.script == "-":
+                self.runScript(core, name, sys.stdin, parallel=args.parallel)
+            else:
+                with open(args.script) as stream:
+                    self.runScript(core, name, stream, parallel=args.parallel)
+        if args.serve is not None:
+            from server import serve
+            serve(core, name, args.serve)
+        return not (args.batch or args.script is not None or args.serve is not None)
+
+    @classmethod
+    def buildParser(self, name, parserClass=argparse.ArgumentParser):
+        """Build the ArgumentParser for all arguments.
+
+        @rtype:  tuple
+        @return: The parser and the arguments grouped by their weight
+        """
         call_buckets = collections.defaultdict(list)
         # Build the ArgumentParser
-        arg_parser = argparse.ArgumentParser(name)
+        arg_parser = parserClass(name)
         for name, arg in self.arguments.iteritems():
             arg_parser.add_argument(
                 "--{}".format(name),
                 **{key: val for key, val in filter(lambda e: e is not None, [
-                    ("nargs", len(arg.args)) if len(arg.args) > 0 else None,
-                    ("metavar", arg.args) if arg.action == "store" else None,
+                    ("nargs", "+" if arg.map_inputs else len(arg.args)) if len(arg.args) > 0 else None,
+                    ("metavar", arg.args[0] if arg.map_inputs else arg.args) if arg.action == "store" else None,
                     ("type", arg.type) if arg.action == "store" else None,
                     ("default", arg.default),
                     ("action", arg.action),
@@ -49,28 +163,255 @@ class CommandLine(object):
                                 help="Run in batch mode (Don't show the gui)",
                                 action="store_true",
                                 default=sys.flags.interactive)
-        # Parse all arguments
-        args = arg_parser.parse_args()
+        # Add preference overrides
+        arg_parser.add_argument("--set", metavar="KEY=VALUE",
+                                help="Override a preference value",
+                                action="append",
+                                default=[])
+        # Add parallel execution
+        arg_parser.add_argument("--parallel",
+                                help="Run independent actions of the same weight at the same time, in threads or processes",
+                                nargs="?",
+                                const="thread",
+                                choices=["thread", "process"],
+                                default=None)
+        # Add data parallel execution
+        arg_parser.add_argument("--jobs", "-j", metavar="N",
+                                help="Distribute the inputs of mapping actions to N processes",
+                                type=int,
+                                default=1)
+        # Add script execution
+        arg_parser.add_argument("--script", metavar="FILE",
+                                help="Run the actions of every line in a file ('-' for stdin), implies batch mode",
+                                default=None)
+        # Add the resident server
+        arg_parser.add_argument("--serve", metavar="SOCKET",
+                                help="Keep serving the actions of clients through a UNIX socket, implies batch mode",
+                                default=None)
+        return arg_parser, call_buckets
+
+    @classmethod
+    def selectCalls(self, core, args, arg_parser, call_buckets):
+        """Select the actions of parsed arguments, ordered by their weight.
+
+        @param args: The parsed arguments
+
+        @type  arg_parser: argparse.ArgumentParser
+        @param arg_parser: The parser, reporting unavailable actions
+
+        @type  call_buckets: dict
+        @param call_buckets: The arguments grouped by their weight
+
+        @rtype:  list
+        @return: The (argument, parameters) of the actions, one list per weight
+        """
         # Check all actions
         logger.debug(call_buckets)
-        call_order = sorted(call_buckets.keys())
-        for weight in call_order:
+        selected = []
+        for weight in sorted(call_buckets.keys()):
+            calls = []
             for arg in call_buckets[weight]:
                 params = getattr(args, arg.name.replace("-", "_"))
-                method = getattr(core, arg.method)
                 if params is not None and params != arg.default:
-                    if isinstance(params, list):
-                        method(*params)
-                    else:
-                        method()
-        return not args.batch
+                    if not hasattr(core, arg.method):
+                        arg_parser.error("--{} is not available in {}".format(arg.name, core.__class__.__name__))
+                    calls.append((arg, params))
+            selected.append(calls)
+        return selected
+
+    @classmethod
+    def execute(self, core, args, arg_parser, call_buckets):
+        """Run all actions of parsed arguments, ordered by their weight.
+        See `selectCalls` for the parameters."""
+        for calls in self.selectCalls(core, args, arg_parser, call_buckets):
+            if args.parallel is not None:
+                self.callParallel(core, calls, args.parallel, args.jobs)
+            else:
+                for arg, params in calls:
+                    self.call(core, arg, params, args.jobs)
+
+    @classmethod
+    def runScript(self, core, name, stream, report=sys.stderr, parallel=None):
+        """Run the actions of every line of a script on the same core.
+        Lines are written like command line arguments, e.g.
+        `--export data.csv`. Empty lines and comments (#) are skipped.
+        A failing line does not stop the script.
+
+        @type  stream: file
+        @param stream: The script
+
+        @type  report: file
+        @param report: The status and time of every line is written to it.
+                       None disables the report.
+
+        @type  parallel: str
+        @param parallel: Run the actions of a line in parallel, see `handle`
+
+        @rtype:  list
+        @return: A `CommandResult` for every line
+        """
+        arg_parser, call_buckets = self.buildParser(name, ScriptArgumentParser)
+        results = []
+        for lineno, line in enumerate(stream, 1):
+            command = line.strip()
+            if command == "" or command.startswith("#"):
+                continue
+            result = CommandResult(lineno, command, "ok")
+            start = timeit.default_timer()
+            try:
+                args = arg_parser.parse_args(shlex.split(command))
+                if args.script is not None or args.serve is not None:
+                    raise ValueError("--script and --serve are not available in scripts")
+                if parallel is not None and args.parallel is None:
+                    args.parallel = parallel
+                if len(args.set) > 0 and getattr(core, "preferences", None) is not None:
+                    core.preferences.loadArguments(args.set)
+                self.execute(core, args, arg_parser, call_buckets)
+            except Exception as e:
+                logger.debug("Script line {} failed".format(lineno), exc_info=True)
+                result.status = "failed"
+                result.error = e
+            result.seconds = timeit.default_timer() - start
+            results.append(result)
+            if report is not None:
+                report.write("{r.status:<6} {r.seconds:9.3f}s  {r.command}{error}\n".format(r=result, error="" if result.error is None else ": {}".format(result.error)))
+        if report is not None:
+            report.write("{} commands, {} failed, {:.3f}s\n".format(len(results), sum(1 for r in results if r.error is not None), sum(r.seconds for r in results)))
+        return results
+
+    @classmethod
+    def call(self, core, arg, params, jobs=1):
+        """Call the action of an argument.
+        A *map_inputs* action is called for every input, see `callMapped`."""
+        method = getattr(core, arg.method)
+        if arg.map_inputs:
+            return self.callMapped(core, arg, params, jobs)
+        if isinstance(params, list):
+            return method(*params)
+        else:
+            return method()
+
+    @classmethod
+    def callMapped(self, core, arg, inputs, jobs=1, progress=None):
+        """Call a *map_inputs* action for every input.
+        With more than one job, the inputs are distributed in chunks to a
+        pool of forked processes, so a single input does not pay the
+        transfer between the processes. Off the main thread, e.g. inside a
+        server, the pool uses threads instead.
+
+        @type  inputs: list
+        @param inputs: The inputs
+
+        @type  jobs: int
+        @param jobs: Number of processes
+
+        @type  progress: file
+        @param progress: Stream for the progress bar. Defaults to stderr,
+                         if it is a terminal.
+
+        @rtype:  list
+        @return: The results in the order of the inputs
+        """
+        method = getattr(core, arg.method)
+        if progress is None and sys.stderr.isatty():
+            progress = sys.stderr
+        if jobs > 1 and sys.platform == "win32":
+            logger.warning("Parallel jobs need fork, using a single process")
+            jobs = 1
+        jobs = min(jobs, len(inputs))
+        if jobs > 1:
+            chunksize, extra = divmod(len(inputs), jobs * 4)
+            chunksize += 1 if extra else 0
+            if _canFork():
+                logger.debug("Running --{} on {} inputs in {} processes, {} per chunk".format(arg.name, len(inputs), jobs, chunksize))
+                pool = multiprocessing.Pool(jobs, _initWorker, ((core, arg), ))
+                results = pool.imap(_mapInWorker, inputs, chunksize)
+            else:
+                logger.debug("Running --{} on {} inputs in {} threads, {} per chunk".format(arg.name, len(inputs), jobs, chunksize))
+                pool = ThreadPool(jobs)
+                results = pool.imap(method, inputs, chunksize)
+        else:
+            pool = None
+            results = (method(item) for item in inputs)
+        try:
+            collected = []
+            for result in results:
+                collected.append(result)
+                if progress is not None:
+                    _progress(progress, len(collected), len(inputs))
+            if pool is not None:
+                pool.close()
+            return collected
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    @classmethod
+    def callParallel(self, core, calls, mode="thread", jobs=1):
+        """Call the *parallel_safe* actions at the same time, the others
+        one after another afterwards.
+        All actions are run, even if some of them fail.
+
+        @type  calls: list
+        @param calls: (argument, parameters) of every action
+
+        @type  mode: str
+        @param mode: 'thread' or 'process'. Actions in processes run in a
+                     forked copy of the core, only their results return.
+                     Off the main thread the actions always run in threads.
+
+        @type  jobs: int
+        @param jobs: Number of processes for mapping actions, see `callMapped`
+
+        @raise CommandLineError: Some of the actions failed
+        """
+        safe = [(arg, params) for arg, params in calls if arg.parallel_safe]
+        errors = []
+        if mode == "process" and not _canFork():
+            logger.warning("Parallel actions in processes need fork on the main thread, using threads")
+            mode = "thread"
+        if mode == "process" and jobs > 1:
+            # The workers of a pool can't have a pool of their own
+            safe = [(arg, params) for arg, params in safe if not arg.map_inputs]
+        if len(safe) > 1:
+            logger.debug("Running {} in parallel {}s".format(", ".join(arg.name for arg, params in safe), mode))
+            if mode == "process":
+                pool = multiprocessing.Pool(min(len(safe), multiprocessing.cpu_count()), _initWorker, ([(core, arg, params) for arg, params in safe], ))
+                results = [pool.apply_async(_callInWorker, (index, )) for index in xrange(len(safe))]
+            else:
+                pool = ThreadPool(len(safe))
+                results = [pool.apply_async(self.call, (core, arg, params, jobs)) for arg, params in safe]
+            pool.close()
+            for (arg, params), result in zip(safe, results):
+                try:
+                    result.get()
+                except Exception as e:
+                    logger.exception("Action --{} failed".format(arg.name))
+                    errors.append((arg.name, e))
+            pool.join()
+        else:
+            safe = []
+        for arg, params in calls:
+            if (arg, params) not in safe:
+                try:
+                    self.call(core, arg, params, jobs)
+                except Exception as e:
+                    logger.exception("Action --{} failed".format(arg.name))
+                    errors.append((arg.name, e))
+        if len(errors) > 0:
+            raise CommandLineError(errors)
 
     def __init__(self, name, *args, **flags):
         """The constructor for the CommandLine object.
         Accepts the same flags as the add_argument function of the
         ArgumentParser class.
         The *weight* flag can be used to reorder the execution of
-        arguments. 'lighter' commands will go first."""
+        arguments. 'lighter' commands will go first.
+        The *parallel_safe* flag declares, that the action may run at the
+        same time as other actions.
+        The *map_inputs* flag declares, that the action takes a single
+        input and is called for every input given, see `callMapped`."""
         self.name = name
         self.args = args
         self.help = flags.get("help", "")
@@ -78,6 +419,8 @@ class CommandLine(object):
         self.default = flags.get("default", None)
         self.action = flags.get("action", "store")
         self.weight = flags.get("weight", 0)
+        self.parallel_safe = flags.get("parallel_safe", False)
+        self.map_inputs = flags.get("map_inputs", False)
         if self.name in CommandLine.arguments:
             raise KeyError(self.name)
         CommandLine.arguments[self.name] = self
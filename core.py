@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Jelly Core - Headless application core
+
+The `ApplicationCore` is the part of the application, that does not need a
+graphical interface. It never imports wx and needs no display.
+
+Mixins inheriting from the `ApplicationCore` (instead of the
+`InterfaceBuilder`) provide their members and `CommandLine` actions to the
+headless core and to the interface builder alike, since the interface
+builder is based on the application core.
+
+`main` runs the batch mode on the headless core and only imports the gui
+otherwise.
+"""
+
+import sys
+
+import logging
+# We are assuming, that there is an already configured logger present
+logger = logging.getLogger(__name__)
+
+# other jelly modules
+from plugin import MixinMount
+from cli import CommandLine
+
+
+BATCH_FLAGS = ("--batch", "-b", "--no-gui", "--script", "--serve")
+"""The command line flags selecting the batch mode"""
+
+
+class CoreMount(MixinMount):
+    """Mixin mount of the application core"""
+
+
+class ApplicationCore(object):
+    """Jelly Application Core
+
+    The headless core of the application. Dialogs are replaced by log
+    messages, questions are answered with no.
+    """
+    __metaclass__ = CoreMount
+
+    def __init__(self, *args, **kwargs):
+        """
+        @type  self: ApplicationCore
+        @param self: The class instance
+        """
+        logger.debug("Initialize application core")
+        self.suppress_dialogs = True
+        self.preferences = None
+
+    def displayError(self, message, caption='An error occured', logname=None):
+        """Log an error message.
+
+        @type  self: ApplicationCore
+        @param self: The class instance
+
+        @type  message: str
+        @param message: The message
+        """
+        logging.getLogger(logname if logname is not None else __name__).error(message)
+        return True
+
+    def displayWarning(self, message, caption='Warning', logname=None):
+        """Log a warning message.
+
+        @type  self: ApplicationCore
+        @param self: The class instance
+
+        @type  message: str
+        @param message: The message
+        """
+        logging.getLogger(logname if logname is not None else __name__).warning(message)
+        return True
+
+    def displayInformation(self, message, caption='Information', logname=None):
+        """Log an information message.
+
+        @type  self: ApplicationCore
+        @param self: The class instance
+
+        @type  message: str
+        @param message: The message
+        """
+        logging.getLogger(logname if logname is not None else __name__).info(message)
+        return True
+
+    def displayQuestion(self, message, caption='Question', logname=None):
+        """Log a question, nobody can answer it.
+
+        @type  self: ApplicationCore
+        @param self: The class instance
+
+        @type  message: str
+        @param message: The question
+
+        @rtype:  bool
+        @return: Always False
+        """
+        logging.getLogger(logname if logname is not None else __name__).info(message)
+        return False
+
+
+def isBatch(argv):
+    """Check for the batch mode flags.
+
+    @type  argv: list
+    @param argv: The command line arguments
+    """
+    return any(arg.split("=", 1)[0] in BATCH_FLAGS for arg in argv)
+
+
+def main(name, argv=None, **prepare):
+    """Run the application.
+
+    In batch mode the actions are handled by a headless `ApplicationCore`,
+    the gui modules are not even imported. Otherwise the `InterfaceBuilder`
+    handles them and shows the window afterwards.
+
+    @type  name: str
+    @param name: The application name
+
+    @type  argv: list
+    @param argv: The command line arguments, defaults to `sys.argv`
+
+    @param **prepare: Arguments for `InterfaceBuilder.prepare`
+
+    @return: The application core
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if isBatch(argv):
+        core = ApplicationCore()
+        CommandLine.handle(core, name, argv)
+        return core
+    from gui import InterfaceBuilder
+    core = InterfaceBuilder()
+    if CommandLine.handle(core, name, argv):
+        core.prepare(**prepare)
+        core.show()
+    return core
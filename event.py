@@ -21,7 +21,7 @@ logger = logging.getLogger(__name__)
 # Needed for function decorators
 from functools import wraps
 # Import jelly.structure
-from structure import Structure
+from structure import Structure, StructureMeta
 
 
 class SkipEvent(Exception):
@@ -29,10 +29,11 @@ class SkipEvent(Exception):
 """Exception signal to not fire an event"""
 
 
-class Event(type):
+class Event(StructureMeta):
     """Event handling system."""
     def __init__(cls, *args):
         """Give every class-object its own handler list"""
+        super(Event, cls).__init__(*args)
         cls.handlers = []
         logger.debug("Creating handler list on {}".format(cls.__name__))
 
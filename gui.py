@@ -17,23 +17,29 @@ import os.path
 import itertools
 
 # other jelly modules
-from plugin import MixinMount
+from core import CoreMount, ApplicationCore
 from menu import MenuBuilder
 from view import ViewBuilder
 from shortcut import ShortcutBuilder
 
 
-class InterfaceBuilder(wx.App):
+class InterfaceMount(CoreMount):
+    """Mixin mount of the interface builder"""
+
+
+class InterfaceBuilder(wx.App, ApplicationCore):
     """Jelly Interface Builder
 
     The interface builder is the application's core.
     It inherits from `wx.App` and behaves as one.
+    It is based on the headless `ApplicationCore`, all mixins of the
+    application core are available as well.
 
     The interface builder houses a `MenuBuilder` and `ViewBuilder` which form
     the interface. It will automatically load all available views and menus
     (meaning: in any loaded module).
     """
-    __metaclass__ = MixinMount
+    __metaclass__ = InterfaceMount
 
     def __init__(self, *args, **kwargs):
         """
@@ -41,6 +47,7 @@ class InterfaceBuilder(wx.App):
         @type  self: InterfaceBuilder
         @param self: The class instance
         """
+        ApplicationCore.__init__(self, *args, **kwargs)
         logger.debug("Initialize interface builder")
         self.helpProvider = wx.SimpleHelpProvider()
         wx.HelpProvider_Set(self.helpProvider)
@@ -56,6 +63,8 @@ class InterfaceBuilder(wx.App):
             (wx.ACCEL_CTRL, ord('q'), wx.ID_CLOSE),
             (wx.ACCEL_NORMAL, wx.WXK_ESCAPE, wx.ID_CLOSE),
         ]
+        # Run deferred mixin initializers while the application is idle
+        self.Bind(wx.EVT_IDLE, self.OnIdleInit)
 
     def prepare(self, title="Jelly Application", size=(1200, 700)):
         """Prepare the window, by loading all views and menu-entires.
@@ -101,6 +110,19 @@ class InterfaceBuilder(wx.App):
 
         return self.wHnd
 
+    def OnIdleInit(self, event):
+        """Eventhandler for idle events.
+        Runs one deferred mixin initializer per idle event.
+
+        @type  self: InterfaceBuilder
+        @param self: The class instance
+        """
+        if self.runPendingInitializers(limit=1) > 0:
+            event.RequestMore()
+        else:
+            self.Unbind(wx.EVT_IDLE, handler=self.OnIdleInit)
+        event.Skip()
+
     def onWHndCreate(self):
         pass
 
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Jelly Isolation - Out-of-process plugins
+
+A plugin of a `PluginMount` can set the class member `isolated` to True.
+`PluginMount.loadPlugins` will then instantiate it inside a worker process
+and return an `IsolatedPlugin` proxy instead of the instance.
+
+The proxy keeps the duck-typed interface of the plugin: Every method call,
+static and class methods included, is relayed through a pipe to the worker.
+Several calls can be sent in a single batch and generator methods send their
+results back in chunks, whenever the caller asks for the next one. Other
+methods of the plugin can be called while iterating.
+
+Since the plugin runs in another process, it can use another core and will
+never hold the GIL against the main loop. It must not touch any GUI objects
+and all arguments and results of its methods must be picklable.
+"""
+
+import sys
+import thread
+import inspect
+import itertools
+import traceback
+import threading
+import multiprocessing
+import cPickle as pickle
+
+import logging
+# We are assuming, that there is an already configured logger present
+logger = logging.getLogger(__name__)
+
+
+class IsolatedPluginError(Exception):
+    """An isolated plugin raised an exception, that could not be transferred
+    into the calling process."""
+
+
+# Message types
+CALL, STREAM, GETATTR, RESULT, CHUNK, END, ERROR, NEXT, CANCEL = range(9)
+
+
+def _error():
+    """Wrap the current exception for the transfer to the caller"""
+    exc = traceback.format_exc()
+    try:
+        error = pickle.loads(pickle.dumps(sys.exc_info()[1], pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        error = IsolatedPluginError(exc)
+    error.remoteTraceback = exc
+    return error
+
+
+def _serve(conn, plugin, args, kwargs):
+    """Main loop of the worker process.
+
+    @type  conn: multiprocessing.Connection
+    @param conn: The worker side of the pipe
+
+    @type  plugin: type
+    @param plugin: The plugin class
+    """
+    try:
+        instance = plugin(*args, **kwargs)
+    except Exception:
+        conn.send((ERROR, _error()))
+        return
+    conn.send((RESULT, None))
+    streams = {}
+    streamIds = itertools.count()
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        kind = message[0]
+        if kind == CALL:
+            results = []
+            for name, a, kw in message[1]:
+                try:
+                    results.append((True, getattr(instance, name)(*a, **kw)))
+                except Exception:
+                    results.append((False, _error()))
+            conn.send((RESULT, results))
+        elif kind == GETATTR:
+            try:
+                conn.send((RESULT, getattr(instance, message[1])))
+            except Exception:
+                conn.send((ERROR, _error()))
+        elif kind == STREAM:
+            name, a, kw = message[1:]
+            try:
+                stream = next(streamIds)
+                streams[stream] = iter(getattr(instance, name)(*a, **kw))
+                conn.send((RESULT, stream))
+            except Exception:
+                conn.send((ERROR, _error()))
+        elif kind == NEXT:
+            stream, chunksize = message[1:]
+            try:
+                chunk = list(itertools.islice(streams[stream], chunksize))
+                if len(chunk) < chunksize:
+                    del streams[stream]
+                    conn.send((END, chunk))
+                else:
+                    conn.send((CHUNK, chunk))
+            except Exception:
+                streams.pop(stream, None)
+                conn.send((ERROR, _error()))
+        elif kind == CANCEL:
+            generator = streams.pop(message[1], None)
+            if hasattr(generator, "close"):
+                generator.close()
+            conn.send((RESULT, None))
+    conn.close()
+
+
+class BatchCall(object):
+    """Collects method calls to an isolated plugin, sending them to the
+    worker in a single message.
+
+    Use it as a context manager, the results are available afterwards:
+
+        with proxy.remoteBatch() as batch:
+            batch.foo(1)
+            batch.bar(2)
+        foo, bar = batch.results
+    """
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.calls = []
+        self.results = None
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        if excType is None:
+            self.results = self.proxy.remoteCallMany(self.calls)
+
+
+class IsolatedPlugin(object):
+    """Proxy for a plugin living in a worker process.
+
+    The methods of the proxy itself are named to not shadow the methods
+    of the plugin.
+
+    The worker is shut down with the proxy, at the end of a with statement
+    or by `shutdown`:
+
+        with Plugin.loadPlugins()[0] as proxy:
+            proxy.foo()
+    """
+
+    streamChunkSize = 64
+    """Number of items a generator method sends per request"""
+
+    def __init__(self, plugin, *args, **kwargs):
+        """Start the worker process and instantiate the plugin.
+
+        @type  plugin: type
+        @param plugin: The plugin class
+
+        @param *args: Positional arguments for the plugin
+
+        @param **kwargs: Keyword arguments for the plugin
+        """
+        self.pluginClass = plugin
+        self._lock = threading.Lock()
+        self._owner = None
+        self._conn, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, name=plugin.__name__, args=(child, plugin, args, kwargs))
+        self._process.daemon = True
+        logger.debug("Starting isolated plugin {}".format(plugin.__name__))
+        self._process.start()
+        child.close()
+        kind, value = self._conn.recv()
+        if kind == ERROR:
+            self._process.join()
+            raise value
+
+    def _exchange(self, message):
+        """Send a message and receive the answer.
+
+        @raise RuntimeError: The proxy is used while this thread waits for
+                             an answer, e.g. by a signal handler
+        """
+        if self._owner == thread.get_ident():
+            raise RuntimeError("{!r} can't be used while waiting for an answer".format(self))
+        with self._lock:
+            self._owner = thread.get_ident()
+            try:
+                self._conn.send(message)
+                kind, value = self._conn.recv()
+            finally:
+                self._owner = None
+        if kind == ERROR:
+            raise value
+        return kind, value
+
+    def _request(self, message):
+        return self._exchange(message)[1]
+
+    def remoteCallMany(self, calls):
+        """Call several methods of the plugin with a single message.
+
+        @type  calls: list
+        @param calls: A list of (name, args, kwargs) tuples
+
+        @rtype:  list
+        @return: The results in the order of the calls.
+                 A failed call has its exception as result.
+        """
+        return [value for ok, value in self._request((CALL, list(calls)))]
+
+    def remoteCall(self, name, *args, **kwargs):
+        """Call a method of the plugin."""
+        (ok, value), = self._request((CALL, [(name, args, kwargs)]))
+        if not ok:
+            raise value
+        return value
+
+    def remoteStream(self, name, *args, **kwargs):
+        """Call a generator method of the plugin.
+        The worker produces the next chunk of items, when the previous
+        one is consumed. The proxy can be used between the chunks.
+        An abandoned iterator cancels the generator in the worker."""
+        stream = self._request((STREAM, name, args, kwargs))
+        kind = None
+        try:
+            while kind != END:
+                try:
+                    kind, chunk = self._exchange((NEXT, stream, self.streamChunkSize))
+                except Exception:
+                    # The worker dropped the failed stream
+                    kind = END
+                    raise
+                for item in chunk:
+                    yield item
+        finally:
+            if kind != END:
+                self._request((CANCEL, stream))
+
+    def remoteBatch(self):
+        """Create a context collecting calls for a single message.
+
+        @rtype:  BatchCall
+        """
+        return BatchCall(self)
+
+    def shutdown(self):
+        """Shut down the worker process. Shutting down twice does nothing."""
+        if self._process.is_alive():
+            with self._lock:
+                self._conn.send(None)
+            self._process.join()
+        self._conn.close()
+
+    @property
+    def workerPid(self):
+        """The process id of the worker"""
+        return self._process.pid
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        member = getattr(self.pluginClass, name, None)
+        if inspect.isgeneratorfunction(member):
+            return lambda *args, **kwargs: self.remoteStream(name, *args, **kwargs)
+        if callable(member):
+            return lambda *args, **kwargs: self.remoteCall(name, *args, **kwargs)
+        return self._request((GETATTR, name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.shutdown()
+
+    def __del__(self):
+        # A forgotten proxy must not leave its worker running
+        if "_process" in self.__dict__:
+            try:
+                self.shutdown()
+            except Exception:
+                pass
+
+    def __repr__(self):
+        return "<IsolatedPlugin {} (pid {})>".format(self.pluginClass.__name__, self.workerPid)
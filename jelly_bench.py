@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Jelly Benchmarks
+
+Micro benchmarks for the performance critical parts of jelly.
+Run all benchmarks with `python jelly_bench.py` or select some by name.
+"""
+
+import sys
+import timeit
+import cPickle
+import collections
+
+import structure
+import preference
+
+
+class BenchStructure(structure.Structure):
+    __slots__ = ["foo", "bar", "baz", "qux"]
+    __defaults__ = {"qux": list}
+
+
+class BenchFrozenStructure(structure.FrozenStructure):
+    __slots__ = ["foo", "bar", "baz", "qux"]
+    __defaults__ = {"qux": tuple}
+
+
+class BenchGenericStructure(structure.Structure):
+    """The same structure, using the generic initializer"""
+    __slots__ = ["foo", "bar", "baz", "qux"]
+    __defaults__ = {"qux": list}
+
+    def __init__(self, *args, **kwargs):
+        structure.Structure.__init__(self, *args, **kwargs)
+
+
+def benchStructure(number):
+    """Construction of structures"""
+    results = []
+    for name, kind in (("generated", BenchStructure), ("frozen", BenchFrozenStructure), ("generic", BenchGenericStructure)):
+        results.append(("{}, positional".format(name), timeit.timeit(lambda: kind("FOO", "BAR", "BAZ"), number=number)))
+        results.append(("{}, keyword".format(name), timeit.timeit(lambda: kind(foo="FOO", bar="BAR", baz="BAZ"), number=number)))
+        results.append(("{}, defaults".format(name), timeit.timeit(lambda: kind(), number=number)))
+    return results
+
+
+class BenchPackedStructure(structure.Structure):
+    __slots__ = ["foo", "bar", "baz"]
+    __types__ = {"foo": "l", "bar": "d", "baz": "8s"}
+
+    def __getstate__(self):
+        return self.__getter__(self)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+def benchPacking(number):
+    """Serialization of 1000 structures"""
+    records = [BenchPackedStructure(i, i * 0.5, "record") for i in xrange(1000)]
+    number = max(1, number // 1000)
+    pickled = [cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL) for record in records]
+    packed = BenchPackedStructure.packMany(records)
+    return [
+        ("pickle, encode", timeit.timeit(lambda: [cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL) for record in records], number=number) * 1000),
+        ("pickle, decode", timeit.timeit(lambda: [cPickle.loads(data) for data in pickled], number=number) * 1000),
+        ("packMany", timeit.timeit(lambda: BenchPackedStructure.packMany(records), number=number) * 1000),
+        ("unpackMany", timeit.timeit(lambda: list(BenchPackedStructure.unpackMany(packed)), number=number) * 1000),
+    ]
+
+
+class BenchEnumeration(structure.Enumeration):
+    Alpha, Beta, Gamma, Delta, Epsilon, Zeta, Eta, Theta = range(8)
+
+
+def benchEnumeration(number):
+    """Enumeration lookups"""
+    flags = BenchEnumeration.set(BenchEnumeration.Beta, BenchEnumeration.Eta)
+    return [
+        ("fromString", timeit.timeit(lambda: BenchEnumeration.fromString("BenchEnumeration.Theta"), number=number)),
+        ("toString", timeit.timeit(lambda: BenchEnumeration.toString(7), number=number)),
+        ("EnumSet, contains", timeit.timeit(lambda: BenchEnumeration.Eta in flags, number=number)),
+        ("EnumSet, union", timeit.timeit(lambda: flags | flags, number=number)),
+    ]
+
+
+class BenchPreference(preference.UserPreference):
+    benchValue = preference.ConfigurationValue(42)
+
+
+class BenchPreferenceSection(BenchPreference):
+    """A section"""
+    __prefix__ = "benchSection"
+    width = preference.ConfigurationValue(640)
+
+
+def benchPreference(number):
+    """Reading preference values"""
+    pref = BenchPreference("jelly_bench")
+    snapshot = pref.snapshot()
+    return [
+        ("item", timeit.timeit(lambda: pref["benchValue"], number=number)),
+        ("nested attribute", timeit.timeit(lambda: pref.benchSection.width, number=number)),
+        ("snapshot, item", timeit.timeit(lambda: snapshot.benchValue, number=number)),
+        ("snapshot, nested attribute", timeit.timeit(lambda: snapshot.benchSection.width, number=number)),
+    ]
+
+
+BENCHMARKS = collections.OrderedDict([
+    ("structure", benchStructure),
+    ("packing", benchPacking),
+    ("enumeration", benchEnumeration),
+    ("preference", benchPreference),
+])
+
+
+def main(names=None, number=100000):
+    for name in names or BENCHMARKS.keys():
+        print "{} ({}, {} runs)".format(name, BENCHMARKS[name].__doc__, number)
+        for case, seconds in BENCHMARKS[name](number):
+            print "  {:<30} {:8.3f} us".format(case, seconds / number * 1e6)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,6 +1,18 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
+import os
+import sys
+import shutil
+import threading
+import tempfile
+import array
+import itertools
+import copy
+import json
+import cPickle
+import subprocess
+import StringIO
 import unittest
 
 import structure
@@ -12,6 +24,12 @@ import view
 import menu
 import shortcut
 import logger
+import watcher
+import isolation
+import preference
+import cli
+import core
+import server
 
 
 class PluginTests(unittest.TestCase):
@@ -63,6 +81,28 @@ class PluginTests(unittest.TestCase):
         self.assertEqual(len(plugins), 1)
         self.assertIs(plugins[0].__class__, Plugin)
 
+    def testPluginCapabilities(self):
+        class Hook(object):
+            __metaclass__ = plugin.PluginMount
+
+            def export(self):
+                pass
+
+        class Plugin(Hook):
+            pass
+
+        class ExportPlugin(Hook):
+            def export(self):
+                pass
+
+        class DerivedPlugin(ExportPlugin):
+            def _helper(self):
+                pass
+
+        self.assertEqual(Hook.implementing("export"), (ExportPlugin, DerivedPlugin))
+        self.assertEqual(Hook.implementing("_helper"), ())
+        self.assertEqual(Hook.implementing("missing"), ())
+
     def testTaxonomyPluginAttributes(self):
         class Hook(object):
             __metaclass__ = plugin.TaxonomyPluginMount
@@ -117,6 +157,346 @@ class PluginTests(unittest.TestCase):
         self.assertIsNot(plug.__class__, Hook)
         self.assertIs(plug.__class__, Plugin)
 
+    def testTaxonomyPluginCategories(self):
+        class Hook(object):
+            __metaclass__ = plugin.TaxonomyPluginMount
+
+        class Plugin(Hook):
+            pass
+
+        class FooPlugin(Hook):
+            __category__ = "foo"
+
+        class FooBarPlugin(Hook):
+            __category__ = "foo.bar"
+
+        class FooBazPlugin(Hook):
+            __category__ = "foo.bar"
+
+        self.assertEqual(Hook.countCategory(), 4)
+        self.assertEqual(Hook.countCategory("foo"), 3)
+        self.assertEqual(Hook.countCategory("foo.bar"), 2)
+        self.assertEqual(Hook.countCategory("baz"), 0)
+        self.assertIsNone(Hook.getCategory("foo.baz"))
+        self.assertEqual(set(Hook.iterCategory("foo")), {FooPlugin, FooBarPlugin, FooBazPlugin})
+        categories = Hook.getAllCategories(exclude=["foo"])
+        self.assertEqual(sorted(categories.keys()), ["", "foo.bar"])
+        self.assertEqual(sorted(categories["foo.bar"]), ["FooBarPlugin", "FooBazPlugin"])
+
+    def testTaxonomyNodeRemove(self):
+        root = plugin.TaxonomyNode()
+        root.insert("foo.bar", "Plugin", object)
+        root.insert("foo.bar", "Plugin", object)
+        self.assertEqual(root.count, 1)
+        root.remove("foo.bar", "Plugin")
+        self.assertEqual(root.count, 0)
+        self.assertNotIn("foo", root)
+        self.assertRaises(KeyError, root.remove, "foo", "Plugin")
+
+    def testTaxonomyPluginLazyInstantiation(self):
+        created = []
+
+        class Hook(object):
+            __metaclass__ = plugin.TaxonomyPluginMount
+
+            def __init__(self):
+                created.append(self.__class__)
+
+        class Plugin(Hook):
+            pass
+
+        class OtherPlugin(Hook):
+            __category__ = "other"
+
+        plugins = Hook.lazyPlugins()
+        self.assertEqual(len(plugins), 2)
+        self.assertEqual(created, [])
+        self.assertIs(plugins['Plugin'].__class__, Plugin)
+        self.assertIs(plugins['Plugin'], plugins['Plugin'])
+        self.assertEqual(created, [Plugin])
+        self.assertFalse(plugins.isLoaded('other.OtherPlugin'))
+        plugins.release()
+        self.assertIsNot(plugins['Plugin'].__class__, Hook)
+        self.assertEqual(created, [Plugin, Plugin])
+
+    def testTaxonomyPluginLazyWeak(self):
+        class Hook(object):
+            __metaclass__ = plugin.TaxonomyPluginMount
+
+        class Plugin(Hook):
+            pass
+
+        plugins = plugin.LazyPluginRegistry(Hook, weak=True)
+        plug = plugins['Plugin']
+        self.assertIs(plugins['Plugin'], plug)
+        del plug
+        self.assertFalse(plugins.isLoaded('Plugin'))
+
+    def testPluginReplace(self):
+        class Hook(object):
+            __metaclass__ = plugin.PluginMount
+
+        class Plugin(Hook):
+            def export(self):
+                pass
+
+        class OtherPlugin(Hook):
+            pass
+
+        class Replacement(Hook):
+            def export(self):
+                pass
+
+        Hook.replacePlugin(Plugin, Replacement)
+        self.assertEqual(Hook.plugins, [Replacement, OtherPlugin])
+        self.assertEqual(Hook.implementing("export"), (Replacement, ))
+        Hook.unregisterPlugin(Replacement)
+        self.assertEqual(Hook.plugins, [OtherPlugin])
+        self.assertNotIn("export", Hook.capabilities)
+
+    def testTaxonomyPluginReplace(self):
+        class Hook(object):
+            __metaclass__ = plugin.TaxonomyPluginMount
+
+        class Plugin(Hook):
+            __category__ = "foo"
+
+        Old = Plugin
+
+        class Plugin(Hook):
+            __category__ = "bar"
+
+        Hook.replacePlugin(Old, Plugin)
+        self.assertEqual(Hook.taxonomy.keys(), ["bar.Plugin"])
+        self.assertEqual(Hook.countCategory("foo"), 0)
+        self.assertEqual(Hook.countCategory("bar"), 1)
+
+    def testMixinInitializers(self):
+        class Mount(plugin.MixinMount):
+            pass
+
+        class Core(object):
+            __metaclass__ = Mount
+
+            def __init__(self):
+                self.log = ["core"]
+
+        class Eager(Core):
+            def __init__(self):
+                self.log.append("eager")
+
+        class Deferred(Core):
+            @plugin.deferredInit
+            def __init__(self):
+                self.log.append("deferred")
+
+        class Lazy(Core):
+            @plugin.lazyInit
+            def __init__(self):
+                self.log.append("lazy")
+
+            def lazyMember(self):
+                return self.log[-1]
+
+        class Deferred(Core):
+            # A mixin of the same name from another module
+            __module__ = "jellyother"
+
+            @plugin.deferredInit
+            def __init__(self):
+                self.log.append("other deferred")
+
+        self.assertIs(Eager, Core)
+        core = Core()
+        self.assertEqual(core.log, ["core", "eager"])
+        self.assertEqual(core.__init_timing__.keys(), ["{}.Core".format(__name__), "{}.Eager".format(__name__)])
+        self.assertEqual(core.runPendingInitializers(), 0)
+        self.assertEqual(core.log, ["core", "eager", "deferred", "other deferred"])
+        self.assertEqual(core.lazyMember(), "lazy")
+        self.assertEqual(core.lazyMember(), "lazy")
+        self.assertEqual(core.log, ["core", "eager", "deferred", "other deferred", "lazy"])
+        self.assertIn("{}.Lazy".format(__name__), core.__init_timing__)
+
+
+class WatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.package = os.path.join(self.dirname, "jellytestplugins")
+        os.mkdir(self.package)
+        open(os.path.join(self.package, "__init__.py"), "w").close()
+        open(os.path.join(self.dirname, "jellytesthook.py"), "w").write(
+            "import plugin\n"
+            "class Hook(object):\n"
+            "    __metaclass__ = plugin.PluginMount\n")
+        self.writePlugin("first", 0)
+        sys.path.insert(0, self.dirname)
+        import jellytesthook
+        import jellytestplugins.first
+        self.hook = jellytesthook.Hook
+        self.watcher = watcher.PluginWatcher(self.package)
+
+    def tearDown(self):
+        sys.path.remove(self.dirname)
+        for name in ["jellytesthook", "jellytestplugins", "jellytestplugins.first", "jellytestplugins.second"]:
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.dirname)
+
+    def writePlugin(self, name, version, mtime=0):
+        fname = os.path.join(self.package, "{}.py".format(name))
+        open(fname, "w").write(
+            "from jellytesthook import Hook\n"
+            "class Plugin(Hook):\n"
+            "    version = {}\n".format(version))
+        os.utime(fname, (mtime, mtime))
+
+    def testReload(self):
+        reloaded = []
+        old = self.hook.plugins[0]
+        handler = lambda ev: reloaded.append((ev.old, ev.new))
+        watcher.PluginReloadEvent.handlers.append(handler)
+        try:
+            self.writePlugin("first", 1, mtime=10)
+            self.assertEqual(self.watcher.check(), ["first"])
+        finally:
+            watcher.PluginReloadEvent.handlers.remove(handler)
+        self.assertEqual(len(self.hook.plugins), 1)
+        self.assertIsNot(self.hook.plugins[0], old)
+        self.assertEqual(self.hook.plugins[0].version, 1)
+        self.assertEqual(reloaded, [(old, self.hook.plugins[0])])
+        self.assertEqual(self.watcher.check(), [])
+
+    def testAddRemove(self):
+        self.writePlugin("second", 2)
+        self.watcher.check()
+        self.assertEqual([plug.version for plug in self.hook.plugins], [0, 2])
+        os.remove(os.path.join(self.package, "second.py"))
+        self.watcher.check()
+        self.assertEqual([plug.version for plug in self.hook.plugins], [0])
+
+    def testFailedReload(self):
+        old = self.hook.plugins[0]
+        fname = os.path.join(self.package, "first.py")
+        open(fname, "w").write(
+            "from jellytesthook import Hook\n"
+            "class Plugin(Hook):\n"
+            "    version = 1\n"
+            "class Extra(Hook):\n"
+            "    pass\n"
+            "raise RuntimeError('failed')\n")
+        os.utime(fname, (10, 10))
+        self.assertRaises(RuntimeError, self.watcher.reloadModule, "first")
+        self.assertEqual(self.hook.plugins, [old])
+        self.assertIs(sys.modules["jellytestplugins.first"].Plugin, old)
+        self.writePlugin("first", 2, mtime=20)
+        self.watcher.check()
+        self.assertEqual([plug.version for plug in self.hook.plugins], [2])
+
+    def testBackground(self):
+        self.assertRaises(ValueError, self.watcher.start)
+        dispatched = []
+        ready = threading.Event()
+        self.watcher = watcher.PluginWatcher(self.package, interval=0.01,
+                                             dispatch=lambda func, *args: (dispatched.append((func, args)), ready.set()))
+        self.watcher.start()
+        try:
+            self.writePlugin("first", 1, mtime=10)
+            self.assertTrue(ready.wait(5.0))
+        finally:
+            self.watcher.stop()
+        # Nothing is reloaded, before the dispatched reload runs
+        self.assertEqual(self.hook.plugins[0].version, 0)
+        func, args = dispatched[0]
+        func(*args)
+        self.assertEqual(self.hook.plugins[0].version, 1)
+
+
+class IsolationTests(unittest.TestCase):
+
+    def setUp(self):
+        class Hook(object):
+            __metaclass__ = plugin.PluginMount
+
+        class Plugin(Hook):
+            isolated = True
+
+            def __init__(self, offset):
+                self.offset = offset
+
+            def add(self, value):
+                return value + self.offset
+
+            def pid(self):
+                return os.getpid()
+
+            def count(self, n):
+                for i in xrange(n):
+                    yield i
+
+            def forever(self):
+                return itertools.count()
+
+            def fail(self):
+                raise ValueError("Failed")
+
+            @staticmethod
+            def staticPid():
+                return os.getpid()
+
+            @classmethod
+            def classPid(cls):
+                return os.getpid()
+
+        self.hook = Hook
+        self.plugins = Hook.loadPlugins(10)
+
+    def tearDown(self):
+        for plug in self.plugins:
+            plug.shutdown()
+
+    def testCall(self):
+        plug, = self.plugins
+        self.assertIsInstance(plug, isolation.IsolatedPlugin)
+        self.assertEqual(plug.add(5), 15)
+        self.assertEqual(plug.offset, 10)
+        self.assertNotEqual(plug.pid(), os.getpid())
+        self.assertRaises(ValueError, plug.fail)
+        # Static and class methods run in the worker as well
+        self.assertEqual(plug.staticPid(), plug.workerPid)
+        self.assertEqual(plug.classPid(), plug.workerPid)
+
+    def testShutdown(self):
+        plug, = self.plugins
+        with plug as proxy:
+            self.assertEqual(proxy.add(1), 11)
+        self.assertFalse(plug._process.is_alive())
+        plug.shutdown()
+        process = self.hook.loadPlugins(1)[0]._process
+        # The forgotten proxy shut down its worker
+        self.assertFalse(process.is_alive())
+
+    def testBatch(self):
+        plug, = self.plugins
+        with plug.remoteBatch() as batch:
+            batch.add(1)
+            batch.fail()
+            batch.add(2)
+        self.assertEqual(batch.results[0], 11)
+        self.assertIsInstance(batch.results[1], ValueError)
+        self.assertEqual(batch.results[2], 12)
+
+    def testStream(self):
+        plug, = self.plugins
+        self.assertEqual(list(plug.count(200)), range(200))
+        for i in plug.count(200):
+            break
+        self.assertEqual(plug.add(0), 10)
+        # The proxy can be used while iterating
+        self.assertEqual([plug.add(i) for i in plug.count(200)], range(10, 210))
+        # Endless generators are cancelled
+        self.assertEqual(next(iter(plug.remoteStream("forever"))), 0)
+        self.assertEqual(plug.add(1), 11)
+
 
 class TestStructure(structure.Structure):
     __slots__ = ["foo", "bar", "baz"]
@@ -160,6 +540,655 @@ class StructureTests(unittest.TestCase):
         self.assertIs(struct.kind, TestStructure)
         self.assertIsNot(struct.kind, structure.Structure)
 
+    def testDefaults(self):
+        class DefaultStructure(structure.Structure):
+            __slots__ = ["foo", "bar"]
+            __defaults__ = {"bar": list}
+
+        first, second = DefaultStructure("FOO", baz="BAZ"), DefaultStructure()
+        self.assertEqual(first.foo, "FOO")
+        self.assertIsNone(second.foo)
+        self.assertEqual(first.bar, [])
+        self.assertIsNot(first.bar, second.bar)
+
+    def testCustomInitializer(self):
+        class CustomStructure(structure.Structure):
+            __slots__ = ["foo", "bar"]
+            __defaults__ = {"bar": list}
+
+            def __init__(self, foo):
+                structure.Structure.__init__(self, foo=foo.upper())
+
+        struct = CustomStructure("foo")
+        self.assertEqual(struct.foo, "FOO")
+        self.assertEqual(struct.bar, [])
+
+
+class TypedStructure(structure.Structure):
+    __slots__ = ["x", "y", "name"]
+    __types__ = {"x": "l", "y": "d"}
+
+
+class StructureArrayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.array = structure.StructureArray(TypedStructure, [TypedStructure(i, i / 2.0, str(i)) for i in range(10)])
+
+    def testAccess(self):
+        self.assertEqual(len(self.array), 10)
+        self.assertEqual(self.array[3].x, 3)
+        self.assertEqual(self.array[-1].name, "9")
+        self.assertEqual(self.array[2].toStructure(), TypedStructure(2, 1.0, "2"))
+        self.assertRaises(IndexError, self.array.__getitem__, 10)
+        self.array[3].y = 7.5
+        self.assertEqual(self.array.column("y")[3], 7.5)
+
+    def testAppend(self):
+        self.array.appendValues(y=2.5)
+        self.assertEqual(len(self.array), 11)
+        self.assertEqual(self.array[10].x, 0)
+        self.assertEqual(self.array[10].y, 2.5)
+        self.assertIsNone(self.array[10].name)
+        self.array.append(TypedStructure())
+        self.assertEqual((self.array[11].x, self.array[11].y), (0, 0.0))
+
+    def testSelection(self):
+        self.assertEqual([row.x for row in self.array[2:5]], [2, 3, 4])
+        selection = self.array.where("x", lambda x: x > 6)
+        self.assertEqual(len(selection), 3)
+        self.assertEqual([row.name for row in selection], ["7", "8", "9"])
+        self.assertEqual([row.x for row in self.array.where("x", lambda x: x in (1, 2))], [1, 2])
+        self.assertEqual(len(self.array.where("name", lambda name: name is None)), 0)
+        selection = self.array.compress([i % 2 == 0 for i in range(10)])
+        self.assertEqual(list(selection.column("x")), [0, 2, 4, 6, 8])
+
+
+class StructureArrayFallbackTests(StructureArrayTests):
+    """The same tests, with the array module instead of NumPy"""
+
+    def setUp(self):
+        self.addCleanup(setattr, structure, "numpy", structure.numpy)
+        structure.numpy = None
+        StructureArrayTests.setUp(self)
+
+
+class PackedStructure(structure.Structure):
+    __slots__ = ["x", "y", "name"]
+    __types__ = {"x": "l", "y": "d", "name": "4s"}
+
+
+class StructurePackingTests(unittest.TestCase):
+
+    def testPack(self):
+        struct = PackedStructure(1, 2.5, "abcd")
+        data = struct.pack()
+        self.assertEqual(len(data), PackedStructure.layout().size)
+        self.assertEqual(PackedStructure.unpack(data), struct)
+
+    def testPackMany(self):
+        records = [PackedStructure(i, i * 0.5, "r{:03}".format(i)) for i in range(100)]
+        buffer = PackedStructure.packMany(records)
+        self.assertIsInstance(buffer, bytearray)
+        self.assertEqual(list(PackedStructure.unpackMany(buffer)), records)
+        self.assertEqual(list(PackedStructure.unpackMany(memoryview(buffer), count=2, offset=PackedStructure.layout().size)), records[1:3])
+
+    def testNoLayout(self):
+        self.assertRaises(TypeError, TestStructure("FOO", "BAR", "BAZ").pack)
+
+    def testPadding(self):
+        struct = PackedStructure(1, 2.0, "ab")
+        self.assertEqual(PackedStructure.unpack(struct.pack()), struct)
+        self.assertEqual(list(PackedStructure.unpackMany(struct.pack())), [struct])
+
+    def testStructureArray(self):
+        # Values fitting into the columns of an array can be packed
+        large = array.array("l", [sys.maxint])[0]
+        for module in (structure.numpy, None):
+            original, structure.numpy = structure.numpy, module
+            try:
+                records = structure.StructureArray(PackedStructure, [PackedStructure(large, 0.5, "abcd"), PackedStructure(-1, 1.5, "ab")])
+                self.assertEqual(records[1].name, "ab")
+                self.assertEqual(records.where("x", lambda x: x > 0)[0].toStructure().pack(), PackedStructure(large, 0.5, "abcd").pack())
+            finally:
+                structure.numpy = original
+
+
+class FrozenTestStructure(structure.FrozenStructure):
+    __slots__ = ["foo", "bar"]
+
+
+class FrozenTestSubStructure(FrozenTestStructure):
+    pass
+
+
+class FrozenEmptyStructure(structure.FrozenStructure):
+    __slots__ = []
+
+
+class FrozenStructureTests(unittest.TestCase):
+
+    def testImmutable(self):
+        struct = FrozenTestStructure("FOO", bar="BAR")
+        self.assertEqual(struct.foo, "FOO")
+        self.assertEqual(struct.bar, "BAR")
+        self.assertRaises(AttributeError, setattr, struct, "foo", "BAZ")
+        self.assertRaises(AttributeError, delattr, struct, "foo")
+
+    def testHashable(self):
+        cache = {FrozenTestStructure("FOO", "BAR"): 1}
+        self.assertEqual(cache[FrozenTestStructure(foo="FOO", bar="BAR")], 1)
+        self.assertNotIn(FrozenTestStructure("FOO"), cache)
+        self.assertNotEqual(FrozenTestStructure("FOO"), FrozenTestStructure("BAR"))
+
+    def testInterned(self):
+        struct = FrozenTestStructure.interned("FOO", "BAR")
+        self.assertIs(FrozenTestStructure("FOO", "BAR").intern(), struct)
+        self.assertIsNot(FrozenTestStructure.interned("FOO"), struct)
+
+    def testSubclass(self):
+        struct = FrozenTestSubStructure("FOO", "BAR")
+        self.assertEqual((struct.foo, struct.bar), ("FOO", "BAR"))
+        self.assertRaises(AttributeError, setattr, struct, "foo", "BAZ")
+
+    def testEmpty(self):
+        self.assertEqual(FrozenEmptyStructure(), FrozenEmptyStructure())
+        self.assertEqual(hash(FrozenEmptyStructure()), hash(()))
+        self.assertEqual(cPickle.loads(cPickle.dumps(FrozenEmptyStructure(), 2)), FrozenEmptyStructure())
+
+    def testCopy(self):
+        for struct in (FrozenTestStructure("FOO", "BAR"), FrozenTestSubStructure("FOO", ("BAR", ))):
+            for protocol in xrange(cPickle.HIGHEST_PROTOCOL + 1):
+                self.assertEqual(cPickle.loads(cPickle.dumps(struct, protocol)), struct)
+            self.assertEqual(copy.copy(struct), struct)
+            self.assertEqual(hash(copy.deepcopy(struct)), hash(struct))
+
+
+class Color(structure.Enumeration):
+    Red = 1
+    Green = 2
+    Blue = 4
+
+
+class EnumerationTests(unittest.TestCase):
+
+    def testLookup(self):
+        self.assertEqual(list(Color), [Color.Red, Color.Green, Color.Blue])
+        self.assertIs(Color.fromString("Color.Green"), Color.Green)
+        self.assertIs(Color.fromValue(4), Color.Blue)
+        self.assertIs(Color.fromName("Red"), Color.Red)
+        self.assertEqual(Color.toString(2), "Color.Green")
+        self.assertIsNone(Color.fromString("Color.Black"))
+        self.assertEqual({Color.Red: "red"}[1], "red")
+
+    def testEnumSet(self):
+        warm = Color.set(Color.Red, 2)
+        self.assertIn(Color.Red, warm)
+        self.assertNotIn(Color.Blue, warm)
+        self.assertEqual(len(warm), 2)
+        self.assertEqual(list(warm | Color.set(Color.Blue)), list(Color))
+        self.assertEqual(warm & Color.set(Color.Green), Color.set(Color.Green))
+        self.assertEqual(~warm, Color.set(Color.Blue))
+        self.assertEqual(len({warm, Color.set(Color.Green, Color.Red)}), 1)
+        self.assertTrue(Color.set(Color.Red) <= warm)
+        self.assertTrue(Color.set(Color.Red) < warm)
+        self.assertFalse(warm < warm)
+        self.assertTrue(warm <= warm)
+        self.assertTrue(warm > Color.set(Color.Green))
+        self.assertFalse(warm > Color.set(Color.Blue))
+        self.assertFalse(warm > warm)
+        self.assertRaises(TypeError, lambda: warm | 1)
+
+
+class TestPreference(preference.UserPreference):
+    testCacheValue = preference.ConfigurationValue(1, "A cached value")
+
+
+class TestPreferenceDict(TestPreference):
+    """A test section"""
+    __prefix__ = "testDict"
+    size = preference.ConfigurationValue(1)
+    color = preference.ConfigurationValue("red")
+
+
+class PreferenceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pref = TestPreference("jelly_test")
+        self.pref.appdata = tempfile.mkdtemp()
+        self.prefFile = os.path.join(self.pref.appdata, "pref.py")
+
+    def tearDown(self):
+        shutil.rmtree(self.pref.appdata)
+
+    def writePref(self, content, configfile="pref.py"):
+        with open(os.path.join(self.pref.appdata, configfile), "w") as fHnd:
+            fHnd.write(content)
+
+    def testCache(self):
+        self.writePref("testCacheValue = 2\n")
+        self.assertEqual(self.pref.load()["testCacheValue"], 2)
+        cache = preference.PreferenceCache(self.prefFile)
+        self.assertEqual(cache.read(), {"testCacheValue": 2})
+        # A valid cache is used instead of the file
+        cache.write({"testCacheValue": 3})
+        self.assertEqual(self.pref.load()["testCacheValue"], 3)
+        self.assertEqual(self.pref.load(cache=False)["testCacheValue"], 2)
+        # A changed file invalidates the cache
+        self.writePref("testCacheValue = 42\n")
+        self.assertEqual(self.pref.load()["testCacheValue"], 42)
+
+    def testUncachable(self):
+        self.writePref("import os\ntestCacheValue = 4\n")
+        self.assertEqual(self.pref.load()["testCacheValue"], 4)
+        self.assertFalse(os.path.exists(self.prefFile + ".cache"))
+
+    def testDataFormats(self):
+        for configfile in ("pref.json", "pref.ini"):
+            self.pref.configfile = configfile
+            self.pref.apply([("testCacheValue", 5), ("testDict", {"size": 12, "color": "blue"})])
+            self.pref.save()
+            self.pref.apply([("testCacheValue", 1), ("testDict", {"size": 1, "color": "red"})])
+            self.pref.load(configfile)
+            self.assertEqual(self.pref["testCacheValue"], 5)
+            self.assertEqual(self.pref["testDict"]["size"], 12)
+            self.assertEqual(self.pref["testDict"]["color"], "blue")
+
+    def testIniStrings(self):
+        fmt = preference.IniFormat()
+        values = ["two\nlines", "  padded  ", "a ;comment", "'quoted'", u"gr\xfc\xdfe", "", "back\\slash"]
+        entries = dict(("text{}".format(i), value) for i, value in enumerate(values))
+        entries["testList"] = ["a ;b", "c"]
+        entries["testDict"] = {"color": " blue\n"}
+        loaded = dict(fmt.read(StringIO.StringIO(fmt.dump(entries))))
+        # Lists are parsed by their entries
+        self.assertEqual(json.loads(loaded.pop("testList")), ["a ;b", "c"])
+        del entries["testList"]
+        self.assertEqual(loaded, entries)
+
+    def testBulkValidation(self):
+        self.writePref('{"testCacheValue": "one", "testDict": {"size": 3, "color": 1, "shape": "round"}}', "pref.json")
+        with self.assertRaises(preference.ConfigurationValuesInvalidError) as ctx:
+            self.pref.load("pref.json")
+        self.assertEqual([path for path, value, reason in ctx.exception.errors], ["testCacheValue", "testDict.color", "testDict.shape"])
+        self.assertEqual(self.pref["testDict"]["size"], 3)
+
+    def testAutosave(self):
+        saved = []
+        save = self.pref.save
+        self.pref.save = lambda: saved.append(save())
+        self.pref.configfile = "pref.json"
+        self.pref.autosave(10.0)
+        for size in xrange(100):
+            self.pref.apply([("testDict", {"size": size})])
+        self.assertTrue(self.pref.dirty)
+        self.assertEqual(saved, [])
+        self.pref.autosave(None)
+        self.assertEqual(len(saved), 1)
+        self.assertFalse(self.pref.dirty)
+        self.assertEqual(os.listdir(self.pref.appdata), ["pref.json"])
+        self.pref.load("pref.json")
+        self.assertEqual(self.pref["testDict"]["size"], 99)
+
+    def testAutosaveRetry(self):
+        attempts = []
+        done = threading.Event()
+        save = self.pref.save
+
+        def flakySave():
+            attempts.append(None)
+            if len(attempts) == 1:
+                raise IOError("disk full")
+            save()
+            done.set()
+        self.pref.save = flakySave
+        self.pref.configfile = "pref.json"
+        self.pref.autosave(0.01)
+        self.pref.apply([("testDict", {"size": 5})])
+        done.wait(5.0)
+        self.pref.autosave(None)
+        self.assertEqual(len(attempts), 2)
+        self.assertFalse(self.pref.dirty)
+
+
+    def testSavePermissions(self):
+        umask = os.umask(022)
+        try:
+            self.pref.save()
+            self.assertEqual(os.stat(self.prefFile).st_mode & 0777, 0644)
+            os.chmod(self.prefFile, 0640)
+            self.pref.save()
+            self.assertEqual(os.stat(self.prefFile).st_mode & 0777, 0640)
+        finally:
+            os.umask(umask)
+
+    def testSaveCreatesFolder(self):
+        self.addCleanup(shutil.rmtree, self.pref.appdata)
+        self.pref.appdata = os.path.join(self.pref.appdata, "jelly")
+        self.pref.save()
+        self.assertTrue(os.path.exists(os.path.join(self.pref.appdata, "pref.py")))
+
+    def testSubscribe(self):
+        changes = []
+        handler = lambda *change: changes.append(change)
+        self.pref.apply([("testDict", {"size": 1, "color": "red"})])
+        self.pref.subscribe("testDict.size", handler)
+        self.pref.subscribe("testDict", handler)
+        self.pref.apply([("testDict", {"size": 2, "color": "blue"})])
+        self.assertEqual(sorted(changes), [("testDict.color", "red", "blue"), ("testDict.size", 1, 2), ("testDict.size", 1, 2)])
+        del changes[:]
+        self.pref.unsubscribe("testDict", handler)
+        self.pref.apply([("testDict", {"size": 2, "color": "red"}), ("testCacheValue", 7)])
+        self.assertEqual(changes, [])
+
+    def testSnapshot(self):
+        self.pref.apply([("testCacheValue", 8), ("testDict", {"size": 4}), ("testList", [1, 2])])
+        snapshot = self.pref.snapshot()
+        self.assertEqual(snapshot.testCacheValue, 8)
+        self.assertEqual(snapshot.testDict.size, 4)
+        self.assertEqual(snapshot.testList, (1, 2))
+        self.assertRaises(AttributeError, setattr, snapshot, "testCacheValue", 9)
+        self.assertIs(self.pref.snapshot(), snapshot)
+        self.pref.apply([("testDict", {"size": 5})])
+        self.assertEqual(self.pref.snapshot().testDict.size, 5)
+        self.assertEqual(snapshot.testDict.size, 4)
+
+    def testModifiedTracking(self):
+        self.pref.apply([("testDict", {"size": 1, "color": "red"})])
+        self.assertFalse(self.pref.testDict.isModified)
+        self.assertNotIn("testDict", str(self.pref))
+        self.pref.apply([("testDict", {"size": 6})])
+        self.assertEqual(self.pref.testDict.modifiedKeys, set(["size"]))
+        self.assertIn("'size' : 6,", str(self.pref))
+        self.pref.apply([("testDict", {"size": 7})])
+        self.assertIn("'size' : 7,", str(self.pref))
+        self.pref.apply([("testDict", {"size": 1})])
+        self.assertFalse(self.pref.testDict.isModified)
+        self.assertNotIn("testDict", str(self.pref))
+
+    def testTypedList(self):
+        self.pref.add("testTable", preference.TypedConfigurationValueList([0.5, 1.5], contentType=float, min=0.0, max=100.0))
+        self.assertEqual(self.pref["testTable"].typecode, "d")
+        self.pref.configfile = "pref.json"
+        with self.assertRaises(preference.ConfigurationValuesInvalidError) as ctx:
+            self.pref.apply([("testTable", [1.0, 101.0]), ("testTable", ["one"]), ("testTable", range(100))])
+        self.assertEqual(len(ctx.exception.errors), 2)
+        self.assertEqual(list(self.pref["testTable"]), [float(i) for i in xrange(100)])
+        self.pref.save()
+        self.pref.apply([("testTable", [])])
+        self.pref.load("pref.json")
+        self.assertEqual(len(self.pref["testTable"]), 100)
+        self.assertIn("testTable = [0.0, 1.0, 2.0", str(self.pref))
+
+    def testSharedStore(self):
+        self.pref.share()
+        self.addCleanup(self.pref.store.close)
+        reader = preference.SharedPreferenceStore(os.path.join(self.pref.appdata, "pref.shm"))
+        self.addCleanup(reader.close)
+        generation, entries = reader.read()
+        self.assertEqual(entries["testDict"]["size"], self.pref["testDict"]["size"])
+        self.pref.apply([("testCacheValue", 11), ("testDict", {"size": 9})])
+        self.assertEqual(reader.generation, generation + 2)
+        self.assertEqual(reader.read()[1]["testDict"]["size"], 9)
+        self.pref.add("testLarge", preference.ConfigurationValue("x" * 10000))
+        self.assertEqual(len(reader.read()[1]["testLarge"]), 10000)
+        self.pref.add("testShared", preference.TypedConfigurationValueList([1.0, 2.0], contentType=float))
+        self.assertEqual(reader.read()[1]["testShared"], [1.0, 2.0])
+        worker = TestPreference("jelly_test")
+        worker.appdata = self.pref.appdata
+        self.assertEqual(worker.attach().storeGeneration, reader.generation)
+        self.addCleanup(worker.store.close)
+        self.assertFalse(worker.refresh())
+
+    def testLayers(self):
+        self.pref.setLayer("site", [("testDict", {"size": 2, "color": "green"})])
+        self.assertEqual(self.pref["testDict"]["size"], 2)
+        self.assertEqual(self.pref.origin("testDict.size"), "site")
+        self.pref.apply([("testDict", {"size": 3})])
+        self.assertEqual(self.pref.origin("testDict.size"), "user")
+        self.pref.loadEnvironment(environ={"JELLY_TEST_TESTDICT__SIZE": "4", "JELLY_TEST_TESTCACHEVALUE": "5"})
+        self.pref.loadArguments(["testCacheValue=6"])
+        self.assertEqual((self.pref["testDict"]["size"], self.pref["testCacheValue"]), (4, 6))
+        self.assertEqual(self.pref.origin("testCacheValue"), "commandline")
+        # Changes by the user are kept below the overrides
+        self.pref.apply([("testDict", {"size": 7})])
+        self.assertEqual(self.pref["testDict"]["size"], 4)
+        self.assertEqual(self.pref.modified()["testDict"], {"size": 7})
+        self.assertNotIn("testCacheValue", self.pref.modified())
+        self.pref.setLayer("environment", [])
+        self.assertEqual(self.pref["testDict"]["size"], 7)
+        self.assertEqual(self.pref["testDict"]["color"], "green")
+
+    def testLayerOverriddenWrites(self):
+        changes = []
+        self.pref.loadEnvironment(environ={"JELLY_TEST_TESTDICT__SIZE": "4"})
+        self.pref.subscribe("testDict.size", lambda *change: changes.append(change))
+        self.pref.apply([("testDict", {"size": 7})])
+        # The resolved value did not change
+        self.assertEqual(changes, [])
+        self.assertEqual(self.pref["testDict"]["size"], 4)
+        self.assertEqual(self.pref.origin("testDict.size"), "environment")
+        self.assertEqual(self.pref.modified()["testDict"], {"size": 7})
+        self.pref.setLayer("environment", [])
+        self.assertEqual(changes, [("testDict.size", 4, 7)])
+
+
+    def testLayerUserWrites(self):
+        self.pref.apply([("testDict", {"size": 7})])
+        self.pref.loadEnvironment(environ={"JELLY_TEST_TESTDICT__SIZE": "4"})
+        # Writing the resolved value still replaces the user value
+        self.pref.apply([("testDict", {"size": 4})])
+        self.assertEqual(self.pref.layers["user"]["testDict.size"], 4)
+        self.pref.setLayer("environment", [])
+        self.assertEqual(self.pref["testDict"]["size"], 4)
+        self.pref.setLayer("site", [("testDict", {"size": 2})])
+        self.pref.apply([("testDict", {"size": 2})])
+        self.assertEqual(self.pref.origin("testDict.size"), "user")
+        self.pref.setLayer("site", [("testDict", {"size": 3})])
+        self.assertEqual(self.pref["testDict"]["size"], 2)
+
+    def testOverriddenTypedList(self):
+        self.pref.add("testTable", preference.TypedConfigurationValueList([0.5], contentType=float))
+        self.pref.apply([("testTable", [1.0, 2.0])])
+        self.pref.loadArguments(["testTable=[3.0]"])
+        self.pref.save()
+        self.assertIn("testTable = [1.0, 2.0]\n", str(self.pref))
+        self.pref.setLayer("commandline", [])
+        self.pref.apply([("testTable", [])])
+        self.pref.load(cache=False)
+        self.assertEqual(list(self.pref["testTable"]), [1.0, 2.0])
+
+    def testRenderRace(self):
+        pref = self.pref
+
+        class Changing(object):
+            """Changes the entry while it is rendered, like another thread"""
+            def __str__(self):
+                pref.apply([("testRace", "new")])
+                return "old"
+
+        self.pref.add("testRace", preference.ConfigurationValue(Changing(), custom=True))
+        self.assertIn("testRace = old", str(self.pref))
+        self.assertIn('testRace = "new"', str(self.pref))
+
+
+class TestCore(object):
+
+    def __init__(self):
+        self.exported = threading.Event()
+        self.overlapped = False
+        self.calls = []
+
+    @cli.CommandLine("test-wait", action="store_true", parallel_safe=True)
+    def testWait(self):
+        self.overlapped = self.exported.wait(5.0)
+        self.calls.append("wait")
+
+    @cli.CommandLine("test-export", action="store_true", parallel_safe=True)
+    def testExport(self):
+        self.exported.set()
+        self.calls.append("export")
+
+    @cli.CommandLine("test-fail", action="store_true")
+    def testFail(self):
+        raise ValueError("failed")
+
+    @cli.CommandLine("test-count", "N", type=int)
+    def testCount(self, count):
+        for i in xrange(count):
+            yield i
+
+    @cli.CommandLine("test-square", "N", type=int, map_inputs=True)
+    def testSquare(self, value):
+        self.calls.append(value)
+        return value * value
+    @cli.CommandLine("test-echo", "TEXT")
+    def testEcho(self, text):
+        return text
+
+
+
+class CommandLineTests(unittest.TestCase):
+
+    def testSequential(self):
+        core = TestCore()
+        self.assertFalse(cli.CommandLine.handle(core, "test", ["--test-export", "--batch"]))
+        self.assertEqual(core.calls, ["export"])
+
+    def testParallel(self):
+        core = TestCore()
+        cli.CommandLine.handle(core, "test", ["--test-wait", "--test-export", "--parallel"])
+        self.assertTrue(core.overlapped)
+        self.assertEqual(sorted(core.calls), ["export", "wait"])
+
+    def testParallelErrors(self):
+        core = TestCore()
+        with self.assertRaises(cli.CommandLineError) as ctx:
+            cli.CommandLine.handle(core, "test", ["--test-fail", "--test-export", "--test-wait", "--parallel"])
+        self.assertEqual([name for name, error in ctx.exception.errors], ["test-fail"])
+        self.assertEqual(sorted(core.calls), ["export", "wait"])
+
+    def testMapped(self):
+        core = TestCore()
+        arg = cli.CommandLine.arguments["test-square"]
+        progress = StringIO.StringIO()
+        self.assertEqual(cli.CommandLine.callMapped(core, arg, range(50), jobs=3, progress=progress), [i * i for i in xrange(50)])
+        self.assertTrue(progress.getvalue().endswith("] 50/50\n"))
+        # The inputs were mapped in the workers
+        self.assertEqual(core.calls, [])
+        cli.CommandLine.handle(core, "test", ["--test-square", "2", "3", "--batch"])
+        self.assertEqual(core.calls, [2, 3])
+        # --jobs applies to parallel actions as well
+        for mode in ("thread", "process"):
+            cli.CommandLine.handle(core, "test", ["--test-square", "4", "5", "--test-export", "--jobs", "2", "--parallel", mode, "--batch"])
+        self.assertEqual(core.calls, [2, 3, "export", "export"])
+
+    def testMappedInThread(self):
+        core = TestCore()
+        arg = cli.CommandLine.arguments["test-square"]
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(cli.CommandLine.callMapped(core, arg, range(10), jobs=2)))
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [i * i for i in xrange(10)])
+        # No processes were forked off the main thread
+        self.assertEqual(sorted(core.calls), range(10))
+
+
+    def testScript(self):
+        core = TestCore()
+        report = StringIO.StringIO()
+        script = StringIO.StringIO("# export twice\n--test-export\n\n--test-fail\n--test-unknown\n--help\n--test-export\n")
+        results = cli.CommandLine.runScript(core, "test", script, report=report)
+        self.assertEqual([(r.line, r.status) for r in results], [(2, "ok"), (4, "failed"), (5, "failed"), (6, "failed"), (7, "ok")])
+        self.assertEqual(core.calls, ["export", "export"])
+        self.assertTrue(report.getvalue().endswith("5 commands, 3 failed, {:.3f}s\n".format(sum(r.seconds for r in results))))
+
+
+class ServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.core = TestCore()
+        self.server = server.CommandServer(self.core, "test", os.path.join(self.tmpdir, "test.sock"))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def testRequest(self):
+        messages = list(server.request(self.server.path, ["--test-count", "3"]))
+        self.assertEqual([m.get("item") for m in messages[:-1]], [0, 1, 2])
+        self.assertEqual(messages[-1]["status"], "ok")
+        messages = list(server.request(self.server.path, ["--test-fail"]))
+        self.assertEqual(messages[-1]["status"], "failed")
+        self.assertEqual(messages[-1]["error"], "failed")
+        self.assertEqual([m.get("status") for m in server.request(self.server.path, ["--help"])], ["failed"])
+        messages = list(server.request(self.server.path, ["--test-echo", u"gr\xfc\xdfe"]))
+        self.assertEqual(messages[0]["result"], u"gr\xfc\xdfe")
+        self.assertEqual(messages[-1]["status"], "ok")
+
+    def testSocketPermissions(self):
+        self.assertEqual(os.stat(self.server.path).st_mode & 0777, 0600)
+
+    def testParallelSafe(self):
+        waiting = threading.Thread(target=lambda: list(server.request(self.server.path, ["--test-wait"])))
+        waiting.start()
+        list(server.request(self.server.path, ["--test-export"]))
+        waiting.join()
+        self.assertTrue(self.core.overlapped)
+        self.assertEqual(sorted(self.core.calls), ["export", "wait"])
+    def testExclusivePreferred(self):
+        lock = server.ActionLock()
+        order = []
+
+        def acquire(context, name):
+            with context():
+                order.append(name)
+        exclusive = threading.Thread(target=acquire, args=(lock.exclusive, "exclusive"))
+        shared = threading.Thread(target=acquire, args=(lock.shared, "shared"))
+        with lock.shared():
+            exclusive.start()
+            while lock._waiting == 0:
+                threading.Event().wait(0.01)
+            # New shared actions wait behind the exclusive one
+            shared.start()
+            threading.Event().wait(0.05)
+            self.assertEqual(order, [])
+        exclusive.join()
+        shared.join()
+        self.assertEqual(order, ["exclusive", "shared"])
+
+
+
+class TestHeadlessMixin(core.ApplicationCore):
+
+    def __init__(self, *args, **kwargs):
+        self.converted = []
+
+    @cli.CommandLine("test-convert", "FILE")
+    def testConvert(self, filename):
+        self.converted.append(filename)
+
+
+class ApplicationCoreTests(unittest.TestCase):
+
+    def testBatch(self):
+        app = core.main("test", ["--batch", "--test-convert", "data.csv"])
+        self.assertIsInstance(app, core.ApplicationCore)
+        self.assertEqual(app.converted, ["data.csv"])
+        self.assertFalse(app.displayQuestion("Overwrite?"))
+
+    def testUnavailableAction(self):
+        self.assertRaises(SystemExit, core.main, "test", ["--batch", "--test-export"])
+
+    def testNoWx(self):
+        script = "import sys, core; core.main('test', ['--batch']); sys.exit('wx' in sys.modules)"
+        self.assertEqual(subprocess.call([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__))), 0)
+
 
 class EventTests(unittest.TestCase):
 
@@ -16,6 +16,12 @@ Therefore no special interface declaration is necessary.
 
 """
 
+import timeit
+import weakref
+import collections
+
+from functools import wraps
+
 import logging
 # We are assuming, that there is an already configured logger present
 logger = logging.getLogger(__name__)
@@ -37,7 +43,7 @@ import os
 for module in os.listdir(os.path.dirname(__file__)):
     if module == '__init__.py' or module[-3:] != '.py':
         continue
-__import__(module[:-3], locals(), globals())
+    __import__(module[:-3], locals(), globals())
 del module
 """
     if not os.path.exists(dirname):
@@ -45,6 +51,31 @@ del module
         open("{}/__init__.py".format(dirname), "w").write(pluginInit)
 
 
+_mounts = weakref.WeakSet()
+"""The hook classes of all `PluginMount` and `TaxonomyPluginMount`"""
+
+
+def snapshotRegistries():
+    """Copy the plugin registries of all mounts, e.g. before a plugin
+    module is reloaded.
+
+    @rtype:  dict
+    @return: The registry of every mount, see `restoreRegistries`
+    """
+    return {mount: mount.snapshotRegistry() for mount in _mounts}
+
+
+def restoreRegistries(snapshot):
+    """Restore the plugin registries of all mounts.
+    Mounts created after the snapshot lose all their plugins.
+
+    @type  snapshot: dict
+    @param snapshot: The result of `snapshotRegistries`
+    """
+    for mount in list(_mounts):
+        mount.restoreRegistry(snapshot.get(mount))
+
+
 class PluginMount(type):
     """A simple pluginMount.
     To hook a plugin into the mount, simply let your object inherit from it.
@@ -71,23 +102,131 @@ class PluginMount(type):
             logger.debug("Creating pluginmount {}".format(cls.__name__))
             # Create plugin list
             cls.plugins = []
+            # Create capability index
+            cls.capabilities = {}
             # Set self as base class
             cls.base = cls
+            cls.isMount = lambda self: self.base is self.__class__
+            cls.isPlugin = lambda self: self.base is not self.__class__
+            _mounts.add(cls)
         else:
             logger.debug("Registering plugin {}".format(cls.__name__))
             # Append self to plugin list
-            cls.plugins.append(cls)
-        cls.isMount = lambda self: self.base is self.__class__
-        cls.isPlugin = lambda self: self.base is not self.__class__
+            cls.registerPlugin(cls)
 
     def loadPlugins(cls, *args, **kwargs):
         """Create a list of instantiated plugins
         if this is not called from inside the mount instance, you should
         specify the *caller* argument, to avoid double instantiation of
-        your child class"""
+        your child class.
+
+        Plugins with a true class member `isolated` are instantiated
+        inside a worker process, see `isolation.IsolatedPlugin`."""
         caller = kwargs['caller'].__class__ if 'caller' in kwargs else None
+        if any(getattr(p, 'isolated', False) for p in cls.plugins):
+            from isolation import IsolatedPlugin
+            return [IsolatedPlugin(p, *args, **kwargs) if getattr(p, 'isolated', False) else p(*args, **kwargs)
+                    for p in cls.plugins if p is not caller]
         return [p(*args, **kwargs) for p in cls.plugins if p is not caller]
 
+    def registerPlugin(cls, plugin, index=None):
+        """Hook a plugin into the mount and index its capabilities.
+
+        @type  plugin: type
+        @param plugin: The plugin class
+
+        @type  index: int
+        @param index: The position inside the plugin list.
+                      By default the plugin is appended.
+        """
+        if index is None:
+            cls.plugins.append(plugin)
+        else:
+            cls.plugins.insert(index, plugin)
+        for capability in plugin.getCapabilities():
+            cls.capabilities.setdefault(capability, []).append(plugin)
+
+    def unregisterPlugin(cls, plugin):
+        """Remove a plugin from the mount and its capability index.
+
+        @type  plugin: type
+        @param plugin: The plugin class
+
+        @raise ValueError: If the plugin is not registered
+        """
+        cls.plugins.remove(plugin)
+        for capability in plugin.getCapabilities():
+            implementing = cls.capabilities[capability]
+            implementing.remove(plugin)
+            if len(implementing) == 0:
+                del cls.capabilities[capability]
+
+    def replacePlugin(cls, old, new):
+        """Swap a plugin for another one, keeping its position.
+        Used when a plugin gets reloaded and the new class already
+        registered itself.
+
+        @type  old: type
+        @param old: The plugin class to be replaced
+
+        @type  new: type
+        @param new: The replacement class
+        """
+        if new in cls.plugins:
+            cls.unregisterPlugin(new)
+        index = cls.plugins.index(old)
+        cls.unregisterPlugin(old)
+        cls.registerPlugin(new, index)
+
+    def snapshotRegistry(cls):
+        """Copy the plugin list and the capability index of the mount.
+
+        @rtype:  tuple
+        """
+        return list(cls.plugins), {name: list(plugins) for name, plugins in cls.capabilities.iteritems()}
+
+    def restoreRegistry(cls, state):
+        """Restore a copy of `snapshotRegistry`.
+
+        @type  state: tuple
+        @param state: The copy, None removes all plugins
+        """
+        plugins, capabilities = state if state is not None else ([], {})
+        cls.plugins[:] = plugins
+        cls.capabilities.clear()
+        cls.capabilities.update(capabilities)
+
+    def getCapabilities(cls):
+        """Collect the names of all public methods a plugin implements
+        on its own, meaning those not inherited from the mount.
+
+        @type  cls: type
+        @param cls: The plugin class
+
+        @rtype:  set
+        @return: The method names
+        """
+        inherited = set(cls.base.__mro__)
+        capabilities = set()
+        for clazz in cls.__mro__:
+            if clazz in inherited:
+                continue
+            for name, member in clazz.__dict__.iteritems():
+                if not name.startswith("_") and (callable(member) or isinstance(member, (staticmethod, classmethod))):
+                    capabilities.add(name)
+        return capabilities
+
+    def implementing(cls, name):
+        """Look up all plugins implementing a method on their own.
+
+        @type  name: str
+        @param name: The name of the method
+
+        @rtype:  tuple
+        @return: The plugin classes, in order of registration
+        """
+        return tuple(cls.capabilities.get(name, ()))
+
     def __iter__(self):
         """Iterate all plugins
         """
@@ -95,6 +234,227 @@ class PluginMount(type):
             yield plugin
 
 
+class TaxonomyNode(object):
+    """A single category inside the taxonomy trie.
+
+    Every node knows the plugins registered directly in its category and
+    the number of plugins registered in its whole subtree, thus answering
+    prefix queries and counts by walking only the depth of a category.
+    """
+    __slots__ = ['name', 'path', 'children', 'plugins', 'count']
+
+    def __init__(self, name="", path=""):
+        """
+        @type  name: str
+        @param name: The last element of the category
+
+        @type  path: str
+        @param path: The full category, elements separated by a single dot
+        """
+        self.name = name
+        self.path = path
+        self.children = {}
+        self.plugins = {}
+        self.count = 0
+
+    def find(self, category, create=False):
+        """Find the node of a category below this node.
+
+        @type  category: str
+        @param category: The category, relative to this node
+
+        @type  create: bool
+        @param create: Create missing nodes on the way
+
+        @rtype:  TaxonomyNode
+        @return: The node or None, if the category does not exist
+        """
+        node = self
+        if category == "":
+            return node
+        for part in category.split("."):
+            child = node.children.get(part)
+            if child is None:
+                if not create:
+                    return None
+                path = ".".join((node.path, part)) if node.path != "" else part
+                child = node.children[part] = TaxonomyNode(part, path)
+            node = child
+        return node
+
+    def insert(self, category, name, plugin):
+        """Register a plugin in a category, replacing any plugin with
+        the same name.
+
+        @type  category: str
+        @param category: The category of the plugin
+
+        @type  name: str
+        @param name: The class name of the plugin
+
+        @type  plugin: object
+        @param plugin: The plugin class
+        """
+        node = self.find(category, create=True)
+        if name not in node.plugins:
+            for parent in self.walk(category):
+                parent.count += 1
+        node.plugins[name] = plugin
+
+    def remove(self, category, name):
+        """Remove a plugin from a category.
+        Categories left empty are pruned.
+
+        @type  category: str
+        @param category: The category of the plugin
+
+        @type  name: str
+        @param name: The class name of the plugin
+
+        @raise KeyError: If there is no such plugin
+        """
+        node = self.find(category)
+        if node is None or name not in node.plugins:
+            raise KeyError(".".join((category, name)) if category != "" else name)
+        path = list(self.walk(category))
+        del path[-1].plugins[name]
+        for parent in path:
+            parent.count -= 1
+        for parent, child in reversed(zip(path, path[1:])):
+            if child.count == 0:
+                del parent.children[child.name]
+
+    def walk(self, category):
+        """Iterate all nodes from this node down to a category.
+        Stops early, if the category does not exist.
+
+        @type  category: str
+        @param category: The category, relative to this node
+        """
+        node = self
+        yield node
+        if category == "":
+            return
+        for part in category.split("."):
+            node = node.children.get(part)
+            if node is None:
+                return
+            yield node
+
+    def iternodes(self):
+        """Iterate all nodes of the subtree, including this node"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.itervalues())
+
+    def iterplugins(self):
+        """Iterate all plugin classes of the subtree"""
+        for node in self.iternodes():
+            for plugin in node.plugins.itervalues():
+                yield plugin
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, category):
+        return self.find(category) is not None
+
+    def __repr__(self):
+        return "<TaxonomyNode '{}' ({})>".format(self.path, self.count)
+
+
+class LazyPluginRegistry(collections.Mapping):
+    """Mapping from fully qualified class names onto plugin instances.
+
+    Unlike `TaxonomyPluginMount.loadPlugins` a plugin gets instantiated
+    when its key is accessed for the first time.
+    The keys are a live view onto the taxonomy, plugins registered later
+    on are accessible as well.
+    """
+
+    def __init__(self, mount, args=(), kwargs=None, singleton=True, weak=False):
+        """
+        @type  mount: TaxonomyPluginMount
+        @param mount: The hook class
+
+        @type  args: tuple
+        @param args: Positional arguments passed to every plugin
+
+        @type  kwargs: dict
+        @param kwargs: Keyword arguments passed to every plugin.
+                       The *caller* argument excludes the class of the
+                       caller, like in `TaxonomyPluginMount.loadPlugins`
+
+        @type  singleton: bool
+        @param singleton: Cache the instance, once it was created.
+                          Otherwise every access creates a new instance.
+
+        @type  weak: bool
+        @param weak: Only keep a weak reference onto cached instances.
+                     An instance is released as soon as nobody else is
+                     using it and will be recreated on the next access.
+        """
+        self.mount = mount
+        self.args = args
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.caller = self.kwargs['caller'].__class__ if 'caller' in self.kwargs else None
+        self.singleton = singleton
+        self.instances = weakref.WeakValueDictionary() if weak else {}
+
+    def __getitem__(self, key):
+        if self.singleton and key in self.instances:
+            return self.instances[key]
+        clazz = self.mount.taxonomy[key]
+        if clazz is self.caller:
+            raise KeyError(key)
+        logger.debug("Instantiating plugin {}".format(key))
+        instance = clazz(*self.args, **self.kwargs)
+        if self.singleton:
+            self.instances[key] = instance
+        return instance
+
+    def __iter__(self):
+        for key, clazz in self.mount.taxonomy.iteritems():
+            if clazz is not self.caller:
+                yield key
+
+    def __len__(self):
+        excluded = self.caller is not None and self.caller in self.mount.taxonomy.itervalues()
+        return len(self.mount.taxonomy) - (1 if excluded else 0)
+
+    def __contains__(self, key):
+        return key in self.mount.taxonomy and self.mount.taxonomy[key] is not self.caller
+
+    def isLoaded(self, key):
+        """Test if a plugin is already instantiated.
+
+        @type  key: str
+        @param key: The fully qualified class name
+
+        @rtype:  bool
+        """
+        return key in self.instances
+
+    def loaded(self):
+        """Create a dictionary of all cached instances"""
+        return dict(self.instances.items())
+
+    def release(self, key=None):
+        """Drop cached instances, e.g. under memory pressure.
+        They are recreated on their next access.
+
+        @type  key: str
+        @param key: The fully qualified class name of the plugin to be
+                    released. If no key is given, all plugins are released.
+        """
+        if key is None:
+            self.instances.clear()
+        elif key in self.instances:
+            del self.instances[key]
+
+
 class TaxonomyPluginMount(type):
     """PluginMount for plugins with a taxonomy on its plugins
     To hook a plugin into the mount, let your object inherit from it."""
@@ -123,10 +483,12 @@ class TaxonomyPluginMount(type):
         if not hasattr(cls, 'taxonomy'):
             logger.debug("Creating TaxonomyPluginMount {}".format(cls.__name__))
             cls.taxonomy = {}
+            cls.categories = TaxonomyNode()
             cls.__category__ = ""
+            _mounts.add(cls)
         else:
             logger.debug("Registering plugin {} into taxonomy {}".format(cls.__name__, cls.__category__))
-            cls.taxonomy[cls.FQClassName] = cls
+            cls.registerPlugin(cls)
 
     def __getitem__(cls, key):
         """Implementation of the Indexed-Access-Operator (`[]`).
@@ -149,6 +511,62 @@ class TaxonomyPluginMount(type):
         for key, plugin in cls.taxonomy.iteritems():
             yield plugin
 
+    def registerPlugin(cls, plugin):
+        """Hook a plugin into the taxonomy, replacing any plugin with the
+        same fully qualified class name.
+
+        @type  plugin: object
+        @param plugin: The plugin class
+        """
+        cls.taxonomy[plugin.FQClassName] = plugin
+        cls.categories.insert(plugin.__category__, plugin.__name__, plugin)
+
+    def unregisterPlugin(cls, plugin):
+        """Remove a plugin from the taxonomy.
+        Nothing happens, if another class took the plugins place.
+
+        @type  plugin: object
+        @param plugin: The plugin class
+        """
+        key = plugin.FQClassName
+        if cls.taxonomy.get(key) is plugin:
+            del cls.taxonomy[key]
+            cls.categories.remove(plugin.__category__, plugin.__name__)
+
+    def replacePlugin(cls, old, new):
+        """Swap a plugin for another one.
+        Used when a plugin gets reloaded, even if the new class moved
+        to another category.
+
+        @type  old: object
+        @param old: The plugin class to be replaced
+
+        @type  new: object
+        @param new: The replacement class
+        """
+        cls.unregisterPlugin(old)
+        cls.registerPlugin(new)
+
+    def snapshotRegistry(cls):
+        """Copy the taxonomy of the mount.
+
+        @rtype:  dict
+        """
+        return dict(cls.taxonomy)
+
+    def restoreRegistry(cls, state):
+        """Restore a copy of `snapshotRegistry`.
+
+        @type  state: dict
+        @param state: The copy, None removes all plugins
+        """
+        cls.taxonomy.clear()
+        cls.categories.children.clear()
+        cls.categories.plugins.clear()
+        cls.categories.count = 0
+        for plugin in (state or {}).itervalues():
+            cls.registerPlugin(plugin)
+
     def getFQClassName(cls):
         """
         @type  cls: object
@@ -175,6 +593,16 @@ class TaxonomyPluginMount(type):
         caller = kwargs['caller'].__class__ if 'caller' in kwargs else None
         return {key: clazz(*args, **kwargs) for key, clazz in cls.taxonomy.iteritems() if key is not caller}
 
+    def lazyPlugins(cls, *args, **kwargs):
+        """Create a registry of plugins, instantiated on first access.
+        Takes the same arguments as `TaxonomyPluginMount.loadPlugins`.
+        Every instance is kept as a singleton inside the registry.
+        For other strategies create a `LazyPluginRegistry` directly.
+
+        @rtype:  LazyPluginRegistry
+        """
+        return LazyPluginRegistry(cls, args, kwargs)
+
     def getAllCategories(cls, exclude=[]):
         """Create a dictionary with all categories and the class per
         category.
@@ -184,11 +612,104 @@ class TaxonomyPluginMount(type):
         @type  exclude: list
         @param exclude: List of categories to be excluded
         """
-        d = {}
-        for k, e in map(lambda s: s.rsplit(".", 1), cls.taxonomy.keys()):
-            if k not in exclude:
-                d[k] = [e] if k not in d else d[k] + [e]
-        return d
+        return {node.path: node.plugins.keys()
+                for node in cls.categories.iternodes()
+                if len(node.plugins) > 0 and node.path not in exclude}
+
+    def getCategory(cls, category=""):
+        """Look up the node of a category in the taxonomy trie.
+
+        @type  category: str
+        @param category: The category, elements separated by a single dot
+
+        @rtype:  TaxonomyNode
+        @return: The node or None, if the category does not exist
+        """
+        return cls.categories.find(category)
+
+    def iterCategory(cls, category=""):
+        """Iterate all plugin classes inside a category and all of its
+        subcategories.
+
+        @type  category: str
+        @param category: The category, elements separated by a single dot
+        """
+        node = cls.categories.find(category)
+        if node is not None:
+            for plugin in node.iterplugins():
+                yield plugin
+
+    def countCategory(cls, category=""):
+        """Count the plugins inside a category and all of its
+        subcategories.
+
+        @type  category: str
+        @param category: The category, elements separated by a single dot
+
+        @rtype:  int
+        """
+        node = cls.categories.find(category)
+        return node.count if node is not None else 0
+
+
+def _runInitializer(instance, mixin, initializer, args, kwargs):
+    """Call the initializer of a mixin and record its duration.
+
+    @param instance: The mount instance
+
+    @type  mixin: str
+    @param mixin: The qualified name of the mixin
+
+    @type  initializer: function
+    @param initializer: The initializer of the mixin
+    """
+    start = timeit.default_timer()
+    initializer(instance, *args, **kwargs)
+    instance.__init_timing__[mixin] = timeit.default_timer() - start
+    logger.debug("Initialized mixin '{}' in {:.3f}s".format(mixin, instance.__init_timing__[mixin]))
+
+
+def _lazyMember(mixin, func):
+    """Wrap a member of a mixin with a postponed initializer.
+    The initializer is run on the first call.
+
+    @type  mixin: str
+    @param mixin: The qualified name of the mixin
+
+    @type  func: function
+    @param func: The member
+    """
+    @wraps(func)
+    def member(self, *args, **kwargs):
+        if mixin in self.__init_pending__:
+            self.runPendingInitializers(mixin)
+        return func(self, *args, **kwargs)
+    return member
+
+
+def deferredInit(func):
+    """Decorator for the initializer of a mixin.
+    The initializer is not called on construction of the mount, but
+    later on by `runPendingInitializers`, e.g. during idle time.
+    Calling a member of the mixin runs it right away.
+
+    @type  func: function
+    @param func: The initializer
+    """
+    func.__init_mode__ = "deferred"
+    return func
+
+
+def lazyInit(func):
+    """Decorator for the initializer of a mixin.
+    The initializer is only called, when a member of the mixin is used
+    for the first time.
+
+    @type  func: function
+    @param func: The initializer
+    """
+    func.__init_mode__ = "lazy"
+    return func
 
 
 class MixinMount(type):
@@ -196,36 +717,77 @@ class MixinMount(type):
     Every child class object will be a reference to the base object.
 
     The init functions of all childrens will be called consecutivly.
+    Initializers decorated with `deferredInit` or `lazyInit` are postponed.
+    The time spent in each initializer is recorded in `__init_timing__`.
+    Mixins are identified by their qualified name, i.e. 'module.Class'.
     """
 
     def __new__(cls, name, bases, attrs):
         """Override the __new__ method the create a singleton class
         object"""
+        collection = attrs['__init_collection__'] = []
+
         def init(self, *args, **kwargs):
             """Call all initializer method of all child functions"""
-            for init in self.__init_collection__:
-                init(self, *args, **kwargs)
-
-        if not hasattr(cls, "instance"):
+            if "__init_timing__" not in self.__dict__:
+                # Not yet initialized by the mount of a base class
+                self.__init_timing__ = collections.OrderedDict()
+                self.__init_pending__ = collections.OrderedDict()
+            for mixin, initializer in collection:
+                if hasattr(initializer, "__init_mode__"):
+                    self.__init_pending__[mixin] = (initializer, args, kwargs)
+                else:
+                    _runInitializer(self, mixin, initializer, args, kwargs)
+
+        def runPendingInitializers(self, mixin=None, limit=None):
+            """Run postponed initializers.
+
+            @type  mixin: str
+            @param mixin: Only run the initializer of this mixin, given by
+                          its qualified name.
+                          Otherwise all deferred initializers are run.
+
+            @type  limit: int
+            @param limit: The maximum number of initializers to run
+
+            @rtype:  int
+            @return: The number of deferred initializers still pending
+            """
+            if mixin is not None:
+                pending = [mixin] if mixin in self.__init_pending__ else []
+            else:
+                pending = [key for key, (initializer, args, kwargs) in self.__init_pending__.iteritems()
+                           if initializer.__init_mode__ == "deferred"]
+            for key in pending[:limit]:
+                # Pop first, the initializer might use members of its mixin
+                initializer, args, kwargs = self.__init_pending__.pop(key)
+                _runInitializer(self, key, initializer, args, kwargs)
+            return sum(1 for initializer, args, kwargs in self.__init_pending__.itervalues()
+                       if initializer.__init_mode__ == "deferred")
+
+        if "instance" not in cls.__dict__:
             # 1. Object -> Base class: create class object instance
             if "__init__" in attrs:
-                attrs['__init_collection__'] = [attrs['__init__']]
-            else:
-                attrs['__init_collection__'] = []
+                collection.append(("{}.{}".format(attrs.get("__module__"), name), attrs['__init__']))
             attrs['__init__'] = init
+            attrs['runPendingInitializers'] = runPendingInitializers
             logger.debug("Creating mixinmount {}".format(name))
             cls.instance = super(MixinMount, cls).__new__(cls, name, bases, attrs)
         elif "__init__" in attrs:
             # Every other object: Append all non-dunderscore methods
             logger.debug("Appending methods from '{}' to {}".format(name, cls.instance))
-            cls.instance.__init_collection__.append(attrs["__init__"])
+            mixin = "{}.{}".format(attrs.get("__module__"), name)
+            cls.instance.__init_collection__.append((mixin, attrs["__init__"]))
+            postponed = hasattr(attrs["__init__"], "__init_mode__")
             for name, attr in attrs.iteritems():
                 if not name.startswith("__"):
                     if hasattr(cls.instance, name):
                         logger.warning("Member '{}' already exists in {}".format(name, cls.instance))
+                    if postponed and callable(attr) and not isinstance(attr, type):
+                        attr = _lazyMember(mixin, attr)
                     setattr(cls.instance, name, attr)
-        # Emulate multi inheritance
-        if len(bases) > 1:
+        # Emulate multi inheritance, the mount itself inherits properly
+        if len(bases) > 1 and attrs.get('__init__') is not init:
             for base in bases:
                 if base != cls.instance:
                     for name, member in base.__dict__.iteritems():
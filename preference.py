@@ -5,9 +5,29 @@
 """Helper function to append a preference path inside the user home"""
 
 import os
+import re
 import sys
+import stat
 import time
+import json
+import ast
+import array
+import mmap
+import struct
+import marshal
+import tempfile
+import threading
+import contextlib
+import cPickle as pickle
 from collections import OrderedDict
+from ConfigParser import RawConfigParser
+
+import logging
+# We are assuming, that there is an already configured logger present
+logger = logging.getLogger(__name__)
+
+# other jelly modules
+from event import EventBase
 
 
 def escapeString(s):
@@ -23,10 +43,96 @@ def unescapeString(s):
     return s
 
 
+def _fileMode(filename):
+    """The permissions for a new version of a file: Those of the existing
+    file, or the default permissions, if there is none."""
+    if os.path.exists(filename):
+        return stat.S_IMODE(os.stat(filename).st_mode)
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0666 & ~umask
+
+
+class PreferenceSnapshot(object):
+    """Immutable copy of preference values.
+
+    The values are stored in slots, reading them is a plain attribute
+    access. Dictionaries are snapshots themselves, lists become tuples.
+    A class is generated for every set of keys and reused afterwards.
+    """
+    __slots__ = []
+    __classes__ = {}
+    IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+    @classmethod
+    def create(cls, items):
+        """Create a snapshot.
+
+        @type  items: list
+        @param items: (key, value) pairs. Keys, that are not valid
+                      identifiers are left out.
+
+        @rtype:  PreferenceSnapshot
+        """
+        items = [(key, value) for key, value in items if cls.IDENTIFIER.match(key) and not key.startswith("__")]
+        keys = tuple(key for key, value in items)
+        kind = cls.__classes__.get(keys)
+        if kind is None:
+            kind = type("PreferenceSnapshot", (cls, ), {"__slots__": keys})
+            kind.__setters__ = tuple(kind.__dict__[key].__set__ for key in keys)
+            cls.__classes__[keys] = kind
+        self = object.__new__(kind)
+        for setter, (key, value) in zip(kind.__setters__, items):
+            setter(self, tuple(value) if isinstance(value, list) else value)
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Preference snapshots are read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("Preference snapshots are read-only")
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __repr__(self):
+        return "PreferenceSnapshot({})".format(", ".join("{}={!r}".format(key, getattr(self, key)) for key in self.__slots__))
+
+
 class ConfigurationValueInvalidError(Exception):
     """The validation of the value has failed"""
 
 
+class ConfigurationValuesInvalidError(ConfigurationValueInvalidError):
+    """The validation of several values has failed"""
+
+    def __init__(self, errors):
+        """
+        @type  errors: list
+        @param errors: (key, value, reason) for every invalid value
+        """
+        ConfigurationValueInvalidError.__init__(self, "\n".join("{}: {} ({!r})".format(*err) for err in errors))
+        self.errors = errors
+
+
+class PreferenceChangeEvent(EventBase):
+    """A preference value has changed.
+    The key is the dotted path of the value, e.g. 'section.entry'."""
+    __slots__ = ['key', 'old', 'new']
+
+
+_renderLock = threading.Lock()
+"""Guards the cached representations. A representation is only cached, if
+no change invalidated it while it was rendered, e.g. by the
+`PreferenceWriter`."""
+
+
 class ConfigurationValue(object):
     def __init__(self, default, help="", t=None, min=None, max=None, choices=None, validation=None, custom=False):
         self.value = default
@@ -47,34 +153,136 @@ class ConfigurationValue(object):
         assert callable(validation)
         self.validation = validation
         self.name = ""
+        self.parent = None
+        """The dictionary or preference containing this value"""
+        self.rendered = None
+        """The cached string representation"""
+        self.version = 0
+        """Incremented by every invalidation of the cached representation"""
 
     def setName(self, name):
         self.name = name
+        self.invalidate()
         return self
 
+    def invalidate(self):
+        """Drop the cached representation"""
+        with _renderLock:
+            self.version += 1
+            self.rendered = None
+
+    def cache(self, version, rendered):
+        """Cache a representation, if it is still valid.
+
+        @type  version: int
+        @param version: The `version` when the rendering started
+        """
+        with _renderLock:
+            if self.version == version:
+                self.rendered = rendered
+
+    def setParent(self, parent):
+        self.parent = parent
+        return self
+
+    def changed(self, key, old, new):
+        """Propagate a change to the parents.
+
+        @type  key: str
+        @param key: The path of the changed value, relative to the parent
+        """
+        self.invalidate()
+        if self.parent is not None:
+            self.parent.changed(key, old, new)
+
+    def written(self, key, value):
+        """Propagate a write to the parents, that did not change the value.
+
+        @type  key: str
+        @param key: The path of the value, relative to the parent
+        """
+        if self.parent is not None:
+            self.parent.written(key, value)
+
     def set(self, value):
         if self.validation(value):
             if isinstance(self.value, dict):
+                old = dict(self.value)
                 self.value.update(value)
             else:
+                old = self.value
                 self.value = value
         else:
             raise ConfigurationValueInvalidError(self.name, value)
+        if old != self.value:
+            self.changed(self.name, old, self.value)
+        else:
+            self.written(self.name, self.value)
         return self
 
     def get(self):
         return self.value
 
+    def check(self, value):
+        """Validate a value against the type and the validation of this entry.
+
+        @rtype:  str
+        @return: The reason, why the value is invalid or None
+        """
+        if not self.custom and self.type not in (None, type(None)):
+            if self.type in (int, long, float):
+                valid = isinstance(value, (int, long, float)) and not isinstance(value, bool)
+            elif self.type in (str, unicode):
+                valid = isinstance(value, basestring)
+            else:
+                valid = isinstance(value, self.type)
+            if not valid:
+                return "expected {}".format(self.type.__name__)
+        try:
+            if self.validation(value):
+                return None
+        except Exception as e:
+            return "validation failed: {}".format(e)
+        if self.choices is not None:
+            return "not one of {}".format(", ".join(repr(c) for c in self.choices))
+        return "validation failed"
+
+    def parse(self, text):
+        """Convert the textual representation of a value into the type of
+        this entry.
+
+        @raise ValueError: The text can't be converted
+        """
+        if self.type in (str, unicode) or self.custom:
+            return text
+        elif self.type is bool:
+            if text.lower() in ("1", "true", "yes", "on"):
+                return True
+            elif text.lower() in ("0", "false", "no", "off"):
+                return False
+            raise ValueError("not a boolean: {!r}".format(text))
+        elif self.type in (int, long, float):
+            return self.type(text)
+        return json.loads(text)
+
     def __str__(self):
-        s = "#{}\n".format(self.help) if self.help != "" else ""
-        s += "{} = {}\n".format(self.name, repr(self))
+        s = self.rendered
+        if s is None:
+            version = self.version
+            s = "#{}\n".format(self.help) if self.help != "" else ""
+            s += "{} = {}\n".format(self.name, repr(self))
+            self.cache(version, s)
         return s
 
     def __repr__(self):
-        if self.value.__class__ is str or self.type is str:
-            return "\"{}\"".format(escapeString(str(self.value)))
+        return self.render(self.value)
+
+    def render(self, value):
+        """The representation of a value of this entry in the preference file"""
+        if value.__class__ is str or self.type is str:
+            return "\"{}\"".format(escapeString(str(value)))
         else:
-            return "{}".format(escapeString(str(self.value)))
+            return "{}".format(escapeString(str(value)))
 
     def __eq__(self, other):
         return isinstance(other, ConfigurationValue) and self.get() == other.get()
@@ -92,22 +300,47 @@ class ConfigurationDict(ConfigurationValue):
     def __init__(self, items, help, custom=False):
         entries = {key: ConfigurationValue(val).setName(key) if not isinstance(val, ConfigurationValue) else val for key, val in items.iteritems()}
         ConfigurationValue.__init__(self, entries, help, t=dict, custom=custom)
+        self.lines = {}
+        """The cached representation of every entry"""
+        self.modifiedKeys = set(key for key, entry in entries.iteritems() if entry.isModified)
+        """The keys of all modified entries, kept up to date by `changed`"""
+        for entry in entries.itervalues():
+            entry.setParent(self)
         if not custom:
-            self.defaults = dict()
-            self.defaults.update(items)
+            self.defaults = {key: entry.default for key, entry in entries.iteritems()}
 
     def __str__(self):
-        s = "# {}\n".format(self.help)
-        s += "{} = {}".format(self.name, repr(self))
+        s = self.rendered
+        if s is None:
+            version = self.version
+            s = "# {}\n".format(self.help)
+            s += "{} = {}".format(self.name, repr(self))
+            self.cache(version, s)
         return s
 
     def __repr__(self):
+        version = self.version
         s = "{{\n".format(self.name)
         for key, val in self.values.iteritems():
-            if val.__class__ is str or val.type is str:
-                s += "\t'{}' : \"{}\",\n".format(key, escapeString(str(val.get())))
-            else:
-                s += "\t'{}' : {},\n".format(key, escapeString(str(val.get())))
+            line = self.lines.get(key)
+            if line is None:
+                line = "\t'{}' : {},\n".format(key, val.render(val.get()))
+                with _renderLock:
+                    if self.version == version:
+                        self.lines[key] = line
+            s += line
+        s += "}\n\n"
+        return s
+
+    def render(self, values):
+        """The representation of some of the entries
+
+        @type  values: dict
+        @param values: The values by the keys of their entries
+        """
+        s = "{\n"
+        for key, value in values.iteritems():
+            s += "\t'{}' : {},\n".format(key, self.values[key].render(value))
         s += "}\n\n"
         return s
 
@@ -122,6 +355,27 @@ class ConfigurationDict(ConfigurationValue):
     def get(self, key=None):
         return self if key is None else self[key]
 
+    def changed(self, key, old, new):
+        entry = key.split(".", 1)[0]
+        with _renderLock:
+            self.lines.pop(entry, None)
+            self.version += 1
+        if self.values[entry].isModified:
+            self.modifiedKeys.add(entry)
+        else:
+            self.modifiedKeys.discard(entry)
+        ConfigurationValue.changed(self, "{}.{}".format(self.name, key), old, new)
+
+    def written(self, key, value):
+        ConfigurationValue.written(self, "{}.{}".format(self.name, key), value)
+
+    def snapshot(self):
+        """Create an immutable copy of the values.
+
+        @rtype:  PreferenceSnapshot
+        """
+        return PreferenceSnapshot.create((key, val.snapshot() if isinstance(val, ConfigurationDict) else val.get()) for key, val in self.values.iteritems())
+
     def keys(self):
         return self.values.keys()
 
@@ -158,7 +412,7 @@ class ConfigurationDict(ConfigurationValue):
 
     @property
     def isModified(self):
-        return self.custom or any([self.defaults[key] != self.values[key].get() for key in self.values])
+        return self.custom or len(self.modifiedKeys) > 0
 
     def getKind(self, entry):
         return self.values[entry].kind if entry in self.values else None
@@ -179,6 +433,472 @@ class ConfigurationValueList(ConfigurationDict):
         return ConfigurationValueList
 
 
+def _within(values, lo, hi):
+    """Check the bounds of all values in a single pass"""
+    if len(values) == 0:
+        return True
+    return (lo is None or lo <= min(values)) and (hi is None or max(values) <= hi)
+
+
+class TypedConfigurationValueList(ConfigurationValue):
+    """A homogeneous list of values.
+
+    Numbers are stored in an `array.array`, strings in a tuple. The list is
+    validated and rendered as a whole, not per element. `set` always
+    replaces the stored list, the list returned by `get` must not be
+    modified.
+    """
+    TYPECODES = {int: 'l', long: 'l', float: 'd'}
+    """Array type codes for the numeric content types"""
+
+    def __init__(self, items, help="", contentType=float, appendable=True, min=None, max=None, custom=False):
+        """
+        @type  items: iterable
+        @param items: The default list
+
+        @type  contentType: type
+        @param contentType: The type of all elements
+
+        @param min: Lower bound for all elements
+        @param max: Upper bound for all elements
+        """
+        self.contentType = contentType
+        self.appendable = appendable
+        validation = None
+        if min is not None or max is not None:
+            validation = lambda v, lo=min, hi=max: _within(v, lo, hi)
+        ConfigurationValue.__init__(self, self.convert(items), help, t=list, min=min, max=max, validation=validation, custom=custom)
+
+    def convert(self, items):
+        """Convert a sequence into the storage of the list.
+
+        @raise TypeError: An element has the wrong type
+        """
+        if isinstance(items, basestring):
+            raise TypeError("expected a list of {}".format(self.contentType.__name__))
+        typecode = self.TYPECODES.get(self.contentType)
+        if typecode is not None:
+            try:
+                return array.array(typecode, items)
+            except OverflowError as e:
+                raise TypeError(str(e))
+        items = tuple(items)
+        if self.contentType is not None and not all(isinstance(item, self.contentType) for item in items):
+            raise TypeError("expected a list of {}".format(self.contentType.__name__))
+        return items
+
+    def check(self, value):
+        try:
+            value = self.convert(value)
+        except TypeError:
+            return "expected a list of {}".format(self.contentType.__name__)
+        if not self.validation(value):
+            return "elements out of range"
+        return None
+
+    def set(self, value):
+        try:
+            value = self.convert(value)
+        except TypeError:
+            raise ConfigurationValueInvalidError(self.name, value)
+        return ConfigurationValue.set(self, value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def render(self, value):
+        value = self.convert(value)
+        return repr(list(value) if isinstance(value, tuple) else value.tolist())
+
+    @property
+    def kind(self):
+        return TypedConfigurationValueList
+
+
+# Serialization formats of resolved entries
+MARSHAL, PICKLE = range(2)
+
+
+def dumpEntries(entries):
+    """Serialize resolved entries with `marshal` or, if they contain other
+    objects, with `cPickle`.
+
+    @rtype:  tuple
+    @return: The format and the data
+
+    @raise ValueError: The entries can't be serialized
+    """
+    try:
+        return MARSHAL, marshal.dumps(entries)
+    except ValueError:
+        try:
+            return PICKLE, pickle.dumps(entries, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            raise ValueError(str(e))
+
+
+def loadEntries(fmt, data):
+    """Deserialize entries created by `dumpEntries`"""
+    if fmt == MARSHAL:
+        return marshal.loads(data)
+    elif fmt == PICKLE:
+        return pickle.loads(str(data))
+    raise ValueError("Unknown format {}".format(fmt))
+
+
+class PreferenceCache(object):
+    """Binary snapshot of the entries of a preference file.
+
+    The cache is stored beside the preference file. Its header holds the
+    modification time and size of the preference file, a cache is only used
+    if both still match. The entries are stored with `marshal`, if they
+    contain other objects `cPickle` is used instead.
+    """
+    MAGIC = "JPC1"
+    HEADER = struct.Struct("<4sBdq")
+
+    def __init__(self, filename):
+        """
+        @type  filename: str
+        @param filename: The path of the preference file
+        """
+        self.filename = filename
+        self.cachefile = filename + ".cache"
+
+    def stat(self):
+        st = os.stat(self.filename)
+        return st.st_mtime, st.st_size
+
+    def read(self):
+        """Read the cached entries.
+
+        @rtype:  dict
+        @return: The entries or None, if the cache is missing or outdated
+        """
+        try:
+            mtime, size = self.stat()
+            with open(self.cachefile, "rb") as fHnd:
+                data = fHnd.read()
+            magic, fmt, cmtime, csize = self.HEADER.unpack_from(data)
+            if magic != self.MAGIC or cmtime != mtime or csize != size:
+                return None
+            return loadEntries(fmt, buffer(data, self.HEADER.size))
+        except Exception:
+            logger.debug("Preference cache {} not usable".format(self.cachefile), exc_info=True)
+        return None
+
+    def write(self, entries):
+        """Write the entries of the current preference file.
+        Entries, that can't be serialized, prevent the cache.
+
+        @type  entries: dict
+        @param entries: The entries as executed from the preference file
+
+        @rtype:  bool
+        @return: True, if the cache was written
+        """
+        try:
+            fmt, payload = dumpEntries(entries)
+        except ValueError:
+            logger.debug("Preference entries of {} can't be cached".format(self.filename))
+            return False
+        try:
+            mtime, size = self.stat()
+            fd, tmpname = tempfile.mkstemp(prefix=os.path.basename(self.cachefile), dir=os.path.dirname(self.cachefile))
+            with os.fdopen(fd, "wb") as fHnd:
+                fHnd.write(self.HEADER.pack(self.MAGIC, fmt, mtime, size))
+                fHnd.write(payload)
+            os.rename(tmpname, self.cachefile)
+        except (IOError, OSError):
+            logger.debug("Preference cache {} not writable".format(self.cachefile), exc_info=True)
+            return False
+        return True
+
+    def invalidate(self):
+        """Remove the cache"""
+        try:
+            os.remove(self.cachefile)
+        except OSError:
+            pass
+
+
+class SharedPreferenceStore(object):
+    """Memory mapped snapshot of resolved preference values, shared between
+    processes.
+
+    The owning process publishes the values, all other processes map the
+    same file read-only. A generation counter in the header is incremented
+    before and after every update (a sequence lock): Readers poll it
+    cheaply and retry a read, that overlapped an update.
+    """
+    MAGIC = "JPS1"
+    HEADER = struct.Struct("<4sBxxxQQ")
+    """Magic, format, generation and length of the data"""
+    GENERATION = struct.Struct("<Q")
+    GENERATION_OFFSET = 8
+
+    def __init__(self, filename, owner=False, size=mmap.PAGESIZE):
+        """
+        @type  filename: str
+        @param filename: The path of the mapped file
+
+        @type  owner: bool
+        @param owner: Create the store for publishing, otherwise open an
+                      existing store for reading
+
+        @type  size: int
+        @param size: The initial size of the mapping, it grows as needed
+        """
+        self.filename = filename
+        self.owner = owner
+        if owner:
+            self.fHnd = open(filename, "w+b")
+            self.fHnd.truncate(max(size, self.HEADER.size))
+            self.map = mmap.mmap(self.fHnd.fileno(), 0)
+            self.HEADER.pack_into(self.map, 0, self.MAGIC, MARSHAL, 0, 0)
+        else:
+            self.fHnd = open(filename, "rb")
+            self.map = mmap.mmap(self.fHnd.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.map[:4] != self.MAGIC:
+                self.close()
+                raise ValueError("{} is no shared preference store".format(filename))
+
+    @property
+    def generation(self):
+        """The generation of the published values, odd while an update is
+        in progress."""
+        return self.GENERATION.unpack_from(self.map, self.GENERATION_OFFSET)[0]
+
+    def publish(self, entries):
+        """Publish new values.
+
+        @type  entries: dict
+        @param entries: The resolved values
+
+        @raise ValueError: The values can't be serialized
+        """
+        assert self.owner
+        fmt, payload = dumpEntries(entries)
+        end = self.HEADER.size + len(payload)
+        if end > len(self.map):
+            size = len(self.map)
+            while size < end:
+                size *= 2
+            self.map.resize(size)
+        generation = self.generation
+        self.GENERATION.pack_into(self.map, self.GENERATION_OFFSET, generation + 1)
+        self.map[self.HEADER.size:end] = payload
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, fmt, generation + 2, len(payload))
+
+    def read(self):
+        """Read the published values.
+
+        @rtype:  tuple
+        @return: The generation and the values, None if nothing was
+                 published yet.
+        """
+        while True:
+            generation = self.generation
+            if generation & 1:
+                time.sleep(0)
+                continue
+            magic, fmt, _, length = self.HEADER.unpack_from(self.map)
+            end = self.HEADER.size + length
+            if end > len(self.map):
+                # The store has grown, map it again
+                self.map.close()
+                self.map = mmap.mmap(self.fHnd.fileno(), 0, access=mmap.ACCESS_READ)
+                continue
+            payload = self.map[self.HEADER.size:end]
+            if self.generation == generation:
+                return generation, (loadEntries(fmt, payload) if length > 0 else None)
+
+    def close(self):
+        self.map.close()
+        self.fHnd.close()
+
+
+def _toJson(value):
+    """Convert the values, json can't serialize"""
+    if isinstance(value, array.array):
+        return value.tolist()
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+def _toStr(value):
+    """Convert the unicode strings of decoded JSON"""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, list):
+        return [_toStr(v) for v in value]
+    elif isinstance(value, dict):
+        return OrderedDict((_toStr(k), _toStr(v)) for k, v in value.iteritems())
+    return value
+
+
+class JsonFormat(object):
+    """Preference file as JSON object"""
+    textual = False
+
+    def read(self, fHnd):
+        """Iterate over the entries of a file.
+
+        @rtype:  iterator
+        @return: (key, value) pairs
+        """
+        return json.load(fHnd, object_pairs_hook=OrderedDict).iteritems()
+
+    def dump(self, entries):
+        """Render the entries.
+
+        @type  entries: OrderedDict
+        @param entries: The values of all modified entries
+
+        @rtype:  str
+        """
+        return json.dumps(entries, indent=4, separators=(",", ": "), default=_toJson) + "\n"
+
+
+class IniFormat(object):
+    """Preference file as INI file.
+    Values are stored in the section *preferences*, dictionaries in their own
+    section. All values are converted by `ConfigurationValue.parse`.
+    Strings are written as quoted python literals, keeping newlines and
+    surrounding whitespace. Unquoted strings are read as they are.
+    """
+    textual = True
+    section = "preferences"
+
+    def read(self, fHnd):
+        parser = RawConfigParser()
+        parser.optionxform = str
+        parser.readfp(fHnd)
+        for section in parser.sections():
+            if section == self.section:
+                for key, value in parser.items(section):
+                    yield key, self.unquote(value)
+            else:
+                yield section, OrderedDict((key, self.unquote(value)) for key, value in parser.items(section))
+
+    def dump(self, entries):
+        parser = RawConfigParser()
+        parser.optionxform = str
+        parser.add_section(self.section)
+        for key, value in entries.iteritems():
+            if isinstance(value, dict):
+                parser.add_section(key)
+                for subkey, subvalue in value.iteritems():
+                    parser.set(key, subkey, self.render(subvalue))
+            else:
+                parser.set(self.section, key, self.render(value))
+        lines = []
+        for section in parser.sections():
+            lines.append("[{}]".format(section))
+            lines.extend("{} = {}".format(key, value) for key, value in parser.items(section))
+            lines.append("")
+        return "\n".join(lines)
+
+    def render(self, value):
+        # The parser cuts values at a ';' following whitespace as comment
+        if isinstance(value, basestring):
+            return repr(value).replace(";", "\\x3b")
+        elif isinstance(value, bool):
+            return "true" if value else "false"
+        elif isinstance(value, (int, long, float)):
+            return repr(value)
+        return json.dumps(value, default=_toJson).replace(";", "\\u003b")
+
+    def unquote(self, value):
+        """Convert a quoted string back, see `render`"""
+        if re.match(r"u?(['\"]).*\1$", value):
+            try:
+                return ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                pass
+        return value
+
+
+FORMATS = {
+    ".json": JsonFormat(),
+    ".ini": IniFormat(),
+    ".cfg": IniFormat(),
+}
+"""Data-only preference file formats by their extension.
+All other files are executed as python code."""
+
+
+class PreferenceWriter(threading.Thread):
+    """Background thread saving the preferences after changes.
+
+    Every change restarts the delay, so a burst of changes is saved once.
+    """
+
+    def __init__(self, preference, delay=1.0):
+        """
+        @type  preference: UserPreference
+        @param preference: The preferences to save
+
+        @type  delay: float
+        @param delay: Seconds without changes before saving
+        """
+        threading.Thread.__init__(self, name="PreferenceWriter")
+        self.daemon = True
+        self.preference = preference
+        self.delay = delay
+        self.deadline = None
+        self.running = True
+        self.condition = threading.Condition()
+
+    def schedule(self):
+        """Save after the delay"""
+        with self.condition:
+            self.deadline = time.time() + self.delay
+            self.condition.notify()
+
+    def cancel(self):
+        """Drop a pending save"""
+        with self.condition:
+            self.deadline = None
+
+    def stop(self, flush=True):
+        """Stop the thread.
+
+        @type  flush: bool
+        @param flush: Save pending changes immediately
+        """
+        with self.condition:
+            self.running = False
+            pending = self.deadline is not None
+            self.deadline = None
+            self.condition.notify()
+        self.join()
+        if flush and pending:
+            self.preference.save()
+
+    def run(self):
+        with self.condition:
+            while self.running:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = self.deadline - time.time()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                self.deadline = None
+                self.condition.release()
+                try:
+                    self.preference.save()
+                    failed = False
+                except Exception:
+                    logger.exception("Saving the preferences failed, retrying")
+                    failed = True
+                finally:
+                    self.condition.acquire()
+                if failed and self.deadline is None:
+                    self.deadline = time.time() + self.delay
+
+
 class UserPreferenceMeta(type):
     """Metaclass for User Preference"""
 
@@ -195,12 +915,23 @@ class UserPreferenceMeta(type):
                 if not callable(value):
                     dst[member] = value.setName(member)
         if hasattr(cls, "__prefix__"):
-            cls.__host__.__values__[cls.__prefix__] = ConfigurationDict(dst, help=cls.__doc__)
+            cls.__host__.__values__[cls.__prefix__] = ConfigurationDict(dst, help=cls.__doc__).setName(cls.__prefix__)
 
 
 class UserPreference(object):
+    """The user preferences of an application.
+
+    Values are resolved from ordered layers, each overriding the previous
+    ones: The *default* of every value, a *site* wide file, the *user*
+    preference file, the *environment* and the *commandline*.
+    Changes made by `set` or `load` belong to the *user* layer.
+    The values themselves hold the resolved result, reading them is not
+    affected by the layers. Only the values changed by a layer are
+    resolved again.
+    """
     __metaclass__ = UserPreferenceMeta
     __values__ = OrderedDict()
+    __layers__ = ("default", "site", "user", "environment", "commandline")
 
     def __init__(self, appname):
         if sys.platform == "win32":
@@ -210,6 +941,32 @@ class UserPreference(object):
         self.appname = appname
         self.configfile = None
         self.modules = {}
+        self.dirty = False
+        """Some values changed since the last save"""
+        self.writer = None
+        self.subscribers = {}
+        self._snapshot = None
+        self._rendered = None
+        self._version = 0
+        self.modifiedKeys = set()
+        """The keys of all modified values, kept up to date by `changed`"""
+        self.store = None
+        """The shared store, see `share` and `attach`"""
+        self.storeGeneration = None
+        self._batch = 0
+        self._unpublished = False
+        self.layers = OrderedDict((layer, {}) for layer in self.__layers__[1:])
+        """The values of every layer by their dotted path"""
+        self.origins = {}
+        """The layer of every value, that is not a default"""
+        self.overridden = set()
+        """Top-level keys with values from other layers than *user*"""
+        self._resolving = False
+        self._restoring = False
+        for key, entry in self.__values__.iteritems():
+            entry.setParent(self)
+            if entry.isModified:
+                self.modifiedKeys.add(key)
 
     def addModules(self, **modules):
         self.modules.update(modules)
@@ -217,7 +974,212 @@ class UserPreference(object):
 
     def add(self, name, entry):
         assert isinstance(entry, ConfigurationValue)
-        self.values[name] = entry
+        entry.setName(name).setParent(self)
+        # The writer thread copies the entries under the same lock
+        with _renderLock:
+            self.__values__[name] = entry
+        self._snapshot = None
+        self.invalidate()
+        if entry.isModified:
+            self.modifiedKeys.add(name)
+        else:
+            self.modifiedKeys.discard(name)
+        self.storeChanged()
+        return self
+
+    def changed(self, key, old, new):
+        """A value has changed, notify the subscribers and schedule the
+        autosave.
+        A change of a value overridden by a higher layer only changes the
+        *user* layer, the value itself keeps the override."""
+        if self._restoring:
+            return
+        self.dirty = True
+        self._snapshot = None
+        self.invalidate()
+        if not self._resolving:
+            self.layers["user"][key] = new
+            override = next((layer for layer in reversed(self.__layers__[3:]) if key in self.layers[layer]), None)
+            if override is not None:
+                # Restore the override silently, the resolved value did not change
+                self._restoring = True
+                try:
+                    self.entry(key).set(self.layers[override][key])
+                finally:
+                    self._restoring = False
+                if self.writer is not None:
+                    self.writer.schedule()
+                return
+            self.origins[key] = "user"
+        top = key.split(".", 1)[0]
+        if self.__values__[top].isModified:
+            self.modifiedKeys.add(top)
+        else:
+            self.modifiedKeys.discard(top)
+        if self.writer is not None:
+            self.writer.schedule()
+        self.storeChanged()
+        self.notify(key, old, new)
+
+    def written(self, key, value):
+        """A value was set to its current value. The write still belongs to
+        the *user* layer, the value may be resolved from another layer."""
+        if self._resolving:
+            return
+        self.layers["user"][key] = value
+        if not any(key in self.layers[layer] for layer in self.__layers__[3:]):
+            self.origins[key] = "user"
+        if key.split(".", 1)[0] in self.overridden:
+            self.dirty = True
+            self.invalidate()
+            if self.writer is not None:
+                self.writer.schedule()
+
+    def invalidate(self):
+        """Drop the cached representation"""
+        with _renderLock:
+            self._version += 1
+            self._rendered = None
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context for many changes, the shared store is updated only once
+        at its end."""
+        self._batch += 1
+        try:
+            yield self
+        finally:
+            self._batch -= 1
+            if self._batch == 0 and self._unpublished:
+                self.publish()
+
+    def storeChanged(self):
+        """Publish the changed values, if this process owns a shared store"""
+        if self.store is not None and self.store.owner:
+            if self._batch > 0:
+                self._unpublished = True
+            else:
+                self.publish()
+
+    def share(self, filename=None):
+        """Publish all values in a shared store, for other processes to
+        `attach`. Every later change is published as well.
+
+        @type  filename: str
+        @param filename: The path of the store, by default *pref.shm* inside
+                         the application data folder
+        """
+        filename = filename if filename is not None else os.path.join(self.appdata, "pref.shm")
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        self.store = SharedPreferenceStore(filename, owner=True)
+        self.publish()
+        return self
+
+    def attach(self, filename=None):
+        """Read the values from the shared store of another process.
+        Call `refresh` to pick up later changes.
+
+        @type  filename: str
+        @param filename: The path of the store, see `share`
+        """
+        filename = filename if filename is not None else os.path.join(self.appdata, "pref.shm")
+        self.store = SharedPreferenceStore(filename)
+        self.storeGeneration = None
+        self.refresh()
+        return self
+
+    def publish(self):
+        """Write all values into the shared store.
+        Arrays are published as lists, `marshal` would write them as
+        plain strings."""
+        self._unpublished = False
+        entries = {}
+        plain = lambda value: value.tolist() if isinstance(value, array.array) else value
+        for key, val in self.__values__.iteritems():
+            if isinstance(val, ConfigurationDict):
+                entries[key] = {subkey: plain(subval.get()) for subkey, subval in val.iteritems()}
+            else:
+                entries[key] = plain(val.get())
+        try:
+            self.store.publish(entries)
+        except ValueError:
+            logger.warning("Preferences can't be shared", exc_info=True)
+
+    def refresh(self):
+        """Apply the values of the shared store, if they were changed.
+
+        @rtype:  bool
+        @return: True, if new values were applied
+        """
+        if self.store is None or self.store.owner or self.store.generation == self.storeGeneration:
+            return False
+        generation, entries = self.store.read()
+        if entries is not None:
+            try:
+                self.apply(entries.iteritems())
+            finally:
+                self.loaded()
+        self.storeGeneration = generation
+        return True
+
+    def snapshot(self):
+        """Get an immutable copy of all values, for fast reading.
+        The snapshot is kept until a value changes.
+
+        @rtype:  PreferenceSnapshot
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = PreferenceSnapshot.create((key, val.snapshot() if isinstance(val, ConfigurationDict) else val.get()) for key, val in self.__values__.iteritems())
+            self._snapshot = snapshot
+        return snapshot
+
+    def subscribe(self, key, handler):
+        """Register a handler for changes of a value.
+
+        @type  key: str
+        @param key: The dotted path of the value. Changes of all values
+                    below the path are reported as well, an empty path
+                    subscribes to all changes.
+
+        @type  handler: callable
+        @param handler: Called with the path, the old and the new value
+        """
+        self.subscribers.setdefault(key, []).append(handler)
+        return self
+
+    def unsubscribe(self, key, handler):
+        """Remove a handler registered with `subscribe`"""
+        handlers = self.subscribers.get(key, [])
+        if handler in handlers:
+            handlers.remove(handler)
+            if len(handlers) == 0:
+                del self.subscribers[key]
+        return self
+
+    def notify(self, key, old, new):
+        """Call the subscribers of the value and all of its parents and
+        fire a `PreferenceChangeEvent`"""
+        path = key.split(".")
+        for depth in xrange(len(path), -1, -1):
+            for handler in self.subscribers.get(".".join(path[:depth]), ()):
+                handler(key, old, new)
+        PreferenceChangeEvent.fire(key, old, new)
+
+    def autosave(self, delay=1.0):
+        """Save the preferences in the background after changes.
+
+        @type  delay: float
+        @param delay: Seconds without changes before saving.
+                      None disables the autosave, saving pending changes.
+        """
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+        if delay is not None:
+            self.writer = PreferenceWriter(self, delay)
+            self.writer.start()
         return self
 
     def addMany(self, entries):
@@ -225,26 +1187,328 @@ class UserPreference(object):
             self.add(name, entry)
         return self
 
-    def load(self, configfile="pref.py"):
+    def load(self, configfile="pref.py", cache=True):
+        """Load the user preference file.
+
+        @type  configfile: str
+        @param configfile: The file name inside the application data folder
+
+        @type  cache: bool
+        @param cache: Use the binary snapshot of the file (see `PreferenceCache`),
+                      avoiding its execution, if it did not change.
+        """
         entries = dict()
         self.configfile = configfile
         customPref = os.path.join(self.appdata, self.configfile)
+        fmt = FORMATS.get(os.path.splitext(configfile)[1].lower())
+        if fmt is not None:
+            if os.path.exists(customPref):
+                with open(customPref) as fHnd:
+                    try:
+                        self.apply(fmt.read(fHnd), parse=fmt.textual)
+                    finally:
+                        self.loaded()
+            return self
         if os.path.exists(customPref):
-            execfile(customPref, self.modules, entries)
-        for key, val in entries.iteritems():
-            if key in self.__values__:
-                self.__values__[key].set(val)
+            snapshot = PreferenceCache(customPref)
+            cached = snapshot.read() if cache else None
+            if cached is not None:
+                entries = cached
             else:
-                self.__values__[key] = ConfigurationValue(key, val, custom=True)
+                execfile(customPref, self.modules, entries)
+                if cache:
+                    snapshot.write(entries)
+        with self.batch():
+            for key, val in entries.iteritems():
+                if key in self.__values__:
+                    self.__values__[key].set(val)
+                else:
+                    self.add(key, ConfigurationValue(val, custom=True))
+        self.loaded()
         return self
 
+    def loaded(self):
+        """The values match the file, nothing to save"""
+        self.dirty = False
+        if self.writer is not None:
+            self.writer.cancel()
+
     def save(self, configfile="pref.py"):
+        """Save the modified values.
+        The file is replaced atomically, it is never written partially.
+        """
+        self.configfile = self.configfile or configfile
         customPref = os.path.join(self.appdata, self.configfile)
-        if not os.path.exists(os.path.basename(customPref)):
-            os.makedirs(os.path.basename(customPref))
-        fHnd = open(customPref, "w")
-        fHnd.write(str(self))
-        fHnd.close()
+        PreferenceCache(customPref).invalidate()
+        if not os.path.exists(os.path.dirname(customPref)):
+            os.makedirs(os.path.dirname(customPref))
+        fmt = FORMATS.get(os.path.splitext(customPref)[1].lower())
+        self.dirty = False
+        tmpname = None
+        try:
+            content = str(self) if fmt is None else fmt.dump(self.modified())
+            fd, tmpname = tempfile.mkstemp(prefix=os.path.basename(customPref), dir=os.path.dirname(customPref))
+            with os.fdopen(fd, "w") as fHnd:
+                fHnd.write(content)
+            # mkstemp creates the file for the owner only
+            os.chmod(tmpname, _fileMode(customPref))
+            if sys.platform == "win32" and os.path.exists(customPref):
+                os.remove(customPref)
+            os.rename(tmpname, customPref)
+        except:
+            self.dirty = True
+            if tmpname is not None and os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+
+    def apply(self, entries, parse=False):
+        """Validate and set entries in a single pass.
+        All valid entries are set, the invalid ones are reported at once.
+
+        @type  entries: iterable
+        @param entries: (key, value) pairs. The value of a dictionary entry
+                        is a dictionary itself.
+
+        @type  parse: bool
+        @param parse: The values are text and need to be converted
+                      (see `ConfigurationValue.parse`)
+
+        @raise ConfigurationValuesInvalidError: Some entries were not valid
+        """
+        errors = []
+        with self.batch():
+            for key, value in entries:
+                value = _toStr(value)
+                entry = self.__values__.get(key)
+                if entry is None:
+                    self.add(key, ConfigurationValue(value, custom=True))
+                elif isinstance(entry, ConfigurationDict):
+                    if not isinstance(value, dict):
+                        errors.append((key, value, "expected dict"))
+                        continue
+                    valid = OrderedDict()
+                    for subkey, subvalue in value.iteritems():
+                        if subkey not in entry.values:
+                            errors.append(("{}.{}".format(key, subkey), subvalue, "unknown entry"))
+                            continue
+                        ok, subvalue = self.validate("{}.{}".format(key, subkey), entry.values.get(subkey), subvalue, parse, errors)
+                        if ok:
+                            valid[subkey] = subvalue
+                    entry.set(valid)
+                else:
+                    ok, value = self.validate(key, entry, value, parse, errors)
+                    if ok:
+                        entry.set(value)
+        if len(errors) > 0:
+            raise ConfigurationValuesInvalidError(errors)
+        return self
+
+    def validate(self, path, entry, value, parse, errors):
+        """Validate a single value for `apply` and `setLayer`.
+
+        @rtype:  tuple
+        @return: The validity and the (converted) value
+        """
+        if parse and isinstance(value, basestring):
+            try:
+                value = entry.parse(value)
+            except ValueError as e:
+                errors.append((path, value, str(e)))
+                return False, None
+        reason = entry.check(value)
+        if reason is not None:
+            errors.append((path, value, reason))
+            return False, None
+        return True, value
+
+    def entry(self, path):
+        """Find a value by its dotted path.
+
+        @rtype:  ConfigurationValue
+        @return: The value or None
+        """
+        key, _, subkey = path.partition(".")
+        entry = self.__values__.get(key)
+        if subkey != "":
+            return entry.values.get(subkey) if isinstance(entry, ConfigurationDict) else None
+        return entry
+
+    def setLayer(self, layer, entries, parse=False):
+        """Replace the values of a configuration layer.
+        Only the values, that differ from the previous content of the layer,
+        are resolved again.
+
+        @type  layer: str
+        @param layer: The layer name, see `__layers__`
+
+        @type  entries: iterable
+        @param entries: (key, value) pairs like for `apply`, or
+                        (dotted path, value) pairs
+
+        @type  parse: bool
+        @param parse: The values are text, see `apply`
+
+        @raise ConfigurationValuesInvalidError: Some entries were not valid
+        """
+        errors = []
+        values = {}
+        for key, value in entries:
+            value = _toStr(value)
+            if isinstance(self.__values__.get(key), ConfigurationDict) and isinstance(value, dict):
+                items = [("{}.{}".format(key, subkey), subvalue) for subkey, subvalue in value.iteritems()]
+            else:
+                items = [(key, value)]
+            for path, value in items:
+                entry = self.entry(path)
+                if entry is None:
+                    if "." in path:
+                        errors.append((path, value, "unknown entry"))
+                        continue
+                    self.add(path, ConfigurationValue(value, custom=True))
+                else:
+                    ok, value = self.validate(path, entry, value, parse, errors)
+                    if not ok:
+                        continue
+                values[path] = value
+        old = self.layers[layer]
+        self.layers[layer] = values
+        self.resolve(path for path in set(old) | set(values) if path not in old or path not in values or old[path] != values[path])
+        if len(errors) > 0:
+            raise ConfigurationValuesInvalidError(errors)
+        return self
+
+    def resolve(self, paths):
+        """Set the values of the topmost layers containing them.
+
+        @type  paths: iterable
+        @param paths: The dotted paths of the values
+        """
+        with self.batch():
+            for path in paths:
+                for layer in reversed(self.layers):
+                    if path in self.layers[layer]:
+                        value = self.layers[layer][path]
+                        break
+                else:
+                    layer = "default"
+                    value = self.entry(path).default
+                self.origins[path] = layer
+                key = path.partition(".")[0]
+                if layer in ("default", "user"):
+                    self.overridden.discard(key)
+                else:
+                    self.overridden.add(key)
+                self._resolving = True
+                try:
+                    self.entry(path).set(value)
+                finally:
+                    self._resolving = False
+        self.invalidate()
+
+    def origin(self, path):
+        """The layer a value comes from.
+
+        @type  path: str
+        @param path: The dotted path of the value
+
+        @rtype:  str
+        """
+        return self.origins.get(path, "default")
+
+    def loadSite(self, filename):
+        """Load a site wide preference file into the *site* layer.
+        The format is chosen by the extension (see `FORMATS`), other files
+        are executed as python code.
+
+        @type  filename: str
+        @param filename: The path of the site file
+        """
+        if not os.path.exists(filename):
+            return self
+        fmt = FORMATS.get(os.path.splitext(filename)[1].lower())
+        if fmt is not None:
+            with open(filename) as fHnd:
+                return self.setLayer("site", list(fmt.read(fHnd)), parse=fmt.textual)
+        entries = dict()
+        execfile(filename, self.modules, entries)
+        return self.setLayer("site", entries.iteritems())
+
+    def loadEnvironment(self, prefix=None, environ=None):
+        """Load the environment variables into the *environment* layer.
+        The variable of a value is its dotted path in upper case, prefixed
+        by the application name, with dots replaced by two underscores,
+        e.g. `APPNAME_SECTION__ENTRY`.
+
+        @type  prefix: str
+        @param prefix: The variable prefix, by default the application
+                       name in upper case followed by an underscore
+        """
+        prefix = prefix if prefix is not None else "{}_".format(self.appname.upper())
+        environ = environ if environ is not None else os.environ
+        paths = {}
+        for key, val in self.__values__.iteritems():
+            paths[key.upper()] = key
+            if isinstance(val, ConfigurationDict):
+                for subkey in val:
+                    paths["{}__{}".format(key, subkey).upper()] = "{}.{}".format(key, subkey)
+        entries = []
+        for variable, text in environ.iteritems():
+            if variable.startswith(prefix) and variable[len(prefix):] in paths:
+                entries.append((paths[variable[len(prefix):]], text))
+        return self.setLayer("environment", entries, parse=True)
+
+    def loadArguments(self, assignments):
+        """Load *path=value* assignments into the *commandline* layer.
+
+        @type  assignments: list
+        @param assignments: The assignments, e.g. from the `--set` argument
+                            of the `CommandLine`
+        """
+        entries = []
+        for assignment in assignments:
+            path, sep, text = assignment.partition("=")
+            if sep == "":
+                raise ConfigurationValuesInvalidError([(assignment, None, "expected path=value")])
+            entries.append((path.strip(), text.strip()))
+        return self.setLayer("commandline", entries, parse=True)
+
+    def persisted(self, key, val):
+        """The value of an entry to save.
+        Overridden entries are saved with their values of the *user* layer.
+
+        @rtype:  tuple
+        @return: True and the value, or False if nothing is to be saved
+        """
+        if key not in self.overridden:
+            if key not in self.modifiedKeys:
+                return False, None
+            if isinstance(val, ConfigurationDict):
+                return True, OrderedDict((subkey, subval.get()) for subkey, subval in val.iteritems())
+            return True, val.get()
+        user = self.layers["user"]
+        if isinstance(val, ConfigurationDict):
+            values = OrderedDict((subkey, user[path]) for subkey, path in (
+                (subkey, "{}.{}".format(key, subkey)) for subkey in val) if path in user)
+            return len(values) > 0, values
+        return key in user, user.get(key)
+
+    def modified(self):
+        """Collect the values of all modified entries.
+
+        @rtype:  OrderedDict
+        """
+        entries = OrderedDict()
+        for key, val in self.items():
+            if key in self.overridden:
+                ok, value = self.persisted(key, val)
+                if ok:
+                    entries[key] = value
+            elif key in self.modifiedKeys:
+                if isinstance(val, ConfigurationDict):
+                    entries[key] = OrderedDict((subkey, subval.get()) for subkey, subval in val.iteritems())
+                else:
+                    entries[key] = val.get()
+        return entries
 
     def __str__(self):
         s = ""
@@ -256,9 +1520,25 @@ class UserPreference(object):
         s += "# Last modification: {}\n".format(time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime()))
         s += "# \n"
         s += "\n"
-        for val in self.__values__.itervalues():
-            if val.isModified:
-                s += str(val)
+        rendered = self._rendered
+        if rendered is None:
+            version = self._version
+            parts = []
+            for key, val in self.items():
+                if key in self.overridden:
+                    ok, value = self.persisted(key, val)
+                    if ok:
+                        if isinstance(val, ConfigurationDict):
+                            parts.append("{} = {}".format(key, val.render(value)))
+                        else:
+                            parts.append("{} = {}\n".format(key, val.render(value)))
+                elif key in self.modifiedKeys:
+                    parts.append(str(val))
+            rendered = "".join(parts)
+            with _renderLock:
+                if self._version == version:
+                    self._rendered = rendered
+        s += rendered
         return s
     __repr__ = __str__
 
@@ -291,3 +1571,12 @@ class UserPreference(object):
         for key, val in self.__values__.iteritems():
             yield key, val
         raise StopIteration()
+
+    def items(self):
+        """Copy the entries, safe while another thread adds entries.
+
+        @rtype:  list
+        @return: (key, value) pairs
+        """
+        with _renderLock:
+            return self.__values__.items()
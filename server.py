@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Jelly Server - Resident command server
+
+A resident application core loads its plugins and preferences only once and
+keeps its caches between the invocations. It serves `CommandLine` actions to
+thin clients through a local UNIX socket:
+
+    python app.py --serve /tmp/app.sock
+    python server.py /tmp/app.sock --export data.csv
+
+Every connected client is served in its own thread. Actions declared as
+*parallel_safe* run at the same time, all others wait until they have the
+core for themselves.
+
+The protocol uses one JSON document per line. A request is the list of the
+command line arguments. The server answers with a line for the result of
+every action, a line for every item of an action returning a generator, and
+finally a line with the status of the request:
+
+    ["--export", "data.csv"]
+    {"action": "export", "result": 42}
+    {"status": "ok", "seconds": 0.25}
+"""
+
+import os
+import sys
+import json
+import socket
+import timeit
+import threading
+import contextlib
+import SocketServer
+from types import GeneratorType
+
+import logging
+# We are assuming, that there is an already configured logger present
+logger = logging.getLogger(__name__)
+
+# other jelly modules
+from cli import CommandLine, ScriptArgumentParser
+
+
+class CommandServerError(Exception):
+    """A request failed inside the server"""
+
+
+class ActionLock(object):
+    """Lock of the core, shared by *parallel_safe* actions and held
+    exclusively by all other actions.
+    A waiting exclusive action is preferred over new shared ones, so a stream
+    of *parallel_safe* actions can't starve it."""
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0
+
+    @contextlib.contextmanager
+    def shared(self):
+        with self._condition:
+            while self._exclusive or self._waiting > 0:
+                self._condition.wait()
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._shared -= 1
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._waiting += 1
+            try:
+                while self._exclusive or self._shared > 0:
+                    self._condition.wait()
+            finally:
+                self._waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+    def acquire(self, arg):
+        """The lock for an action.
+
+        @type  arg: CommandLine
+        @param arg: The argument of the action
+        """
+        return self.shared() if arg.parallel_safe else self.exclusive()
+
+
+def _encode(message):
+    return json.dumps(message, default=repr) + "\n"
+
+
+class CommandHandler(SocketServer.StreamRequestHandler):
+    """Serves the requests of a single client"""
+
+    def send(self, **message):
+        self.wfile.write(_encode(message))
+        self.wfile.flush()
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            if line.strip() == "":
+                continue
+            start = timeit.default_timer()
+            try:
+                self.server.run(json.loads(line), self.send)
+            except socket.error:
+                logger.debug("Client disconnected", exc_info=True)
+                return
+            except Exception as e:
+                logger.debug("Request {} failed".format(line.strip()), exc_info=True)
+                self.send(status="failed", error=str(e), seconds=timeit.default_timer() - start)
+            else:
+                self.send(status="ok", seconds=timeit.default_timer() - start)
+
+
+class CommandServer(SocketServer.ThreadingUnixStreamServer):
+    """Serves the `CommandLine` actions of a core through a UNIX socket"""
+    daemon_threads = True
+
+    def __init__(self, core, name, path):
+        """
+        @type  core: ApplicationCore
+        @param core: The core running the actions
+
+        @type  name: str
+        @param name: The application name
+
+        @type  path: str
+        @param path: The path of the socket. A stale socket is replaced.
+        """
+        self.core = core
+        self.name = name
+        self.path = path
+        self.lock = ActionLock()
+        self.parser, self.call_buckets = CommandLine.buildParser(name, ScriptArgumentParser)
+        if os.path.exists(path):
+            os.unlink(path)
+        # The socket is created for the owner only, there is no window to
+        # connect before a chmod
+        umask = os.umask(0177)
+        try:
+            SocketServer.ThreadingUnixStreamServer.__init__(self, path, CommandHandler)
+        finally:
+            os.umask(umask)
+
+    def run(self, argv, send):
+        """Run the actions of a request.
+
+        @type  argv: list
+        @param argv: The command line arguments
+
+        @param send: Called with the keywords of every response
+        """
+        if not isinstance(argv, list):
+            raise CommandServerError("A request is a list of arguments")
+        # The command line of a process holds bytes, JSON strings are unicode
+        args = self.parser.parse_args([arg.encode("utf-8") if isinstance(arg, unicode) else str(arg) for arg in argv])
+        if args.script is not None or args.serve is not None:
+            raise CommandServerError("--script and --serve are not available in requests")
+        if len(args.set) > 0 and getattr(self.core, "preferences", None) is not None:
+            with self.lock.exclusive():
+                self.core.preferences.loadArguments(args.set)
+        for calls in CommandLine.selectCalls(self.core, args, self.parser, self.call_buckets):
+            for arg, params in calls:
+                with self.lock.acquire(arg):
+                    result = CommandLine.call(self.core, arg, params, args.jobs)
+                    if isinstance(result, GeneratorType):
+                        for item in result:
+                            send(action=arg.name, item=item)
+                    else:
+                        send(action=arg.name, result=result)
+
+    def server_close(self):
+        SocketServer.ThreadingUnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def serve(core, name, path):
+    """Serve the actions of a core until interrupted.
+
+    @type  path: str
+    @param path: The path of the socket
+    """
+    server = CommandServer(core, name, path)
+    logger.info("Serving {} on {}".format(name, path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def request(path, argv):
+    """Send a request to a server.
+
+    @type  path: str
+    @param path: The path of the socket
+
+    @type  argv: list
+    @param argv: The command line arguments
+
+    @rtype:  generator
+    @return: The responses, while the server sends them. The last one
+             holds the status of the request.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        client.sendall(_encode(list(argv)))
+        stream = client.makefile("r")
+        for line in iter(stream.readline, ""):
+            message = json.loads(line)
+            yield message
+            if "status" in message:
+                break
+    finally:
+        client.close()
+
+
+def main(argv=None):
+    """Thin client, printing the responses of a server.
+
+    @return: The exit code
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 1:
+        sys.stderr.write("usage: server.py SOCKET [ARGUMENTS ...]\n")
+        return 2
+    status = None
+    for message in request(argv[0], argv[1:]):
+        status = message.get("status")
+        if status is None:
+            value = message.get("item", message.get("result"))
+            if value is not None:
+                print json.dumps(value)
+        elif status != "ok":
+            sys.stderr.write("{}\n".format(message["error"]))
+    return 0 if status == "ok" else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
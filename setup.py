@@ -14,7 +14,7 @@ setup(
     author           = "Hanno Sternberg",
     author_email     = "hanno@almostintelligent.de",
     url              = 'https://github.com/hastern/jelly',
-    py_modules       = ['__init__', 'logger', 'plugin', 'event', 'gui', 'view', 'menu', 'baseobjs', 'structure', 'shortcut'],
+    py_modules       = ['__init__', 'logger', 'plugin', 'event', 'gui', 'view', 'menu', 'baseobjs', 'structure', 'shortcut', 'watcher', 'isolation', 'cli', 'core', 'server'],
     license          = read('LICENSE'),
     long_description = read('README.md'),
 #    install_requires = ['wxpython'],
@@ -1,25 +1,166 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
+import array
+import struct
+import weakref
+import operator
+import itertools
+
 import logging
 # We are assuming, that there is an already configured logger present
 logger = logging.getLogger(__name__)
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _structCode(typecode):
+    """Translate a typecode of the `array` module into the format character
+    of the `struct` module with the same size. Sizes of the `array` module
+    are native, while packed structures use the standard sizes.
+
+    @rtype:  str
+    @return: The format character or None, if the type can't be packed
+    """
+    if typecode[-1:] == 's':
+        return typecode
+    if typecode in ('O', 'u'):
+        return None
+    size = array.array(typecode).itemsize
+    if typecode in 'bhil':
+        return {1: 'b', 2: 'h', 4: 'i', 8: 'q'}[size]
+    if typecode in 'BHIL':
+        return {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}[size]
+    return typecode
+
+
+def _unpad(values, padded):
+    """Strip the padding of the fixed size strings of unpacked values"""
+    values = list(values)
+    for idx in padded:
+        values[idx] = values[idx].rstrip("\0")
+    return values
+
+
+def _newStructure(cls, *args, **kwargs):
+    """Create a structure and initialize all members with their defaults.
+    Used for structures with a custom initializer."""
+    self = object.__new__(cls)
+    for name in cls.__slots__:
+        setattr(self, name, cls.__defaults__[name]() if name in cls.__defaults__ else None)
+    return self
+
+
+class StructureMeta(type):
+    """Metaclass for structures.
+
+    Every structure gets its own initializer, generated once on creation of
+    the class (like `collections.namedtuple` does).
+    The initializer assigns the members directly and handles the defaults,
+    positional and keyword arguments.
+
+    Structures defining their own initializer keep the generic behavior.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(StructureMeta, cls).__init__(name, bases, attrs)
+        cls.__struct__ = cls.buildLayout()
+        types = getattr(cls, '__types__', {})
+        cls.__padded__ = tuple(idx for idx, name in enumerate(cls.__slots__) if types.get(name, 'O')[-1:] == 's')
+        if len(cls.__slots__) > 1:
+            cls.__getter__ = staticmethod(operator.attrgetter(*cls.__slots__))
+        else:
+            cls.__getter__ = staticmethod(lambda record, names=tuple(cls.__slots__): tuple(getattr(record, name) for name in names))
+        initializer = next(c.__dict__['__init__'] for c in cls.__mro__ if '__init__' in c.__dict__)
+        if getattr(initializer, '__generic__', False) and '__init__' in attrs:
+            # The base structure itself
+            pass
+        elif getattr(initializer, '__generated__', False) or getattr(initializer, '__generic__', False):
+            cls.__init__ = cls.buildInitializer()
+        elif not any('__new__' in c.__dict__ for c in cls.__mro__ if c is not object):
+            # Structures with a custom initializer get their defaults on creation
+            cls.__new__ = staticmethod(_newStructure)
+
+    def buildLayout(cls):
+        """Create the binary layout of the structure from the `__types__`
+        of all members.
+
+        @rtype:  struct.Struct
+        @return: The layout or None, if a member has no binary type
+        """
+        types = getattr(cls, '__types__', {})
+        codes = [_structCode(types.get(name, 'O')) for name in cls.__slots__]
+        if len(codes) == 0 or None in codes:
+            return None
+        return struct.Struct("<" + "".join(codes))
+
+    def buildInitializer(cls):
+        """Generate the source of the initializer and compile it.
+        Frozen structures assign their members through the slot
+        descriptors and store their hash afterwards.
+
+        @rtype:  function
+        @return: The initializer
+        """
+        generic = next(c.__dict__['__init__'] for c in cls.__mro__ if getattr(c.__dict__.get('__init__'), '__generic__', False))
+        frozen = getattr(cls, '__frozen__', False)
+        namespace = {'_cls': cls, '_init': generic}
+        positional, keyword, assignments = [], [], []
+        for idx, name in enumerate(cls.__slots__):
+            if name in cls.__defaults__:
+                namespace['_default_{}'.format(name)] = cls.__defaults__[name]
+                default = "_default_{}()".format(name)
+            else:
+                default = "None"
+            value = "args[{idx}] if n > {idx} else {default}".format(idx=idx, default=default)
+            target = "_{}".format(name) if frozen else "self.{}".format(name)
+            positional.append("        {} = {}".format(target, value))
+            keyword.append("        {target} = kwargs['{name}'] if '{name}' in kwargs else {value}".format(target=target, name=name, value=value))
+            if frozen:
+                slot = next(c.__dict__[name] for c in cls.__mro__ if name in c.__dict__)
+                namespace['_set_{}'.format(name)] = slot.__set__
+                assignments.append("    _set_{name}(self, _{name})".format(name=name))
+        if frozen:
+            namespace['_set_hashcode'] = cls._hashcode.__set__
+            assignments.append("    _set_hashcode(self, hash(({})))".format("".join("_{}, ".format(name) for name in cls.__slots__)))
+        source = "\n".join([
+            "def __init__(self, *args, **kwargs):",
+            "    if self.__class__ is not _cls:",
+            "        return _init(self, *args, **kwargs)",
+            "    n = len(args)",
+            "    if kwargs:",
+        ] + (keyword or ["        pass"]) + [
+            "    else:",
+        ] + (positional or ["        pass"]) + assignments)
+        exec compile(source, "<{} initializer>".format(cls.__name__), "exec") in namespace
+        initializer = namespace['__init__']
+        initializer.__generated__ = True
+        initializer.__source__ = source
+        initializer.__doc__ = generic.__doc__
+        return initializer
+
 
 class Structure(object):
     """Simple struct-like object.
     members are controlled via the contents of the __slots__ list."""
+    __metaclass__ = StructureMeta
     __slots__ = []
     """Structure members"""
     __defaults__ = {}
     """Default values for (a part of) the structure members.
     __defaults__.keys() must be a (inproper) subset __slots__."""
-
-    def __new__(cls, *args, **kwargs):
-        self = super(Structure, cls).__new__(cls, *args, **kwargs)
-        # Initialize all members with None
-        map(lambda k: setattr(self, k, cls.__defaults__[k]() if k in cls.__defaults__ else None), cls.__slots__)
-        return self
+    __types__ = {}
+    """Optional type declarations for (a part of) the structure members.
+    Types are given as typecodes of the `array` module, 'O' denotes an
+    arbitrary python object. Strings of a fixed size are given like in the
+    `struct` module, e.g. '16s' for a string of 16 bytes. They are padded
+    with NUL bytes, trailing NUL bytes are stripped when reading them.
+    If all members are typed, the structure can be packed into a binary
+    format. The packed members have the same sizes as in the `array`
+    module, so a value that fits into a `StructureArray` can be packed."""
 
     def __init__(self, *args, **kwargs):
         """
@@ -27,14 +168,112 @@ class Structure(object):
         @param **kwargs: Keyword arguments
         """
         # Positional definition of members
-        map(lambda (name, val): setattr(self, name, val), zip(self.__slots__, args))
+        for name, val in zip(self.__slots__, args):
+            setattr(self, name, val)
         # Keyword definition of members
-        map(lambda k: setattr(self, k, kwargs[k]), filter(lambda k: k in self.__slots__, kwargs))
+        for name in self.__slots__:
+            if name in kwargs:
+                setattr(self, name, kwargs[name])
+    __init__.__generic__ = True
 
     @property
     def kind(self):
         return self.__class__
 
+    @classmethod
+    def layout(cls):
+        """The binary layout of the structure.
+
+        @rtype:  struct.Struct
+
+        @raise TypeError: If not all members have a binary type
+        """
+        if cls.__struct__ is None:
+            raise TypeError("{} has no binary layout, all members need a type".format(cls.__name__))
+        return cls.__struct__
+
+    def pack(self):
+        """Pack the structure into its binary form.
+
+        @rtype:  str
+        """
+        return self.layout().pack(*self.__getter__(self))
+
+    def packInto(self, buffer, offset=0):
+        """Pack the structure into a writable buffer.
+
+        @type  buffer: bytearray
+        @param buffer: The buffer
+
+        @type  offset: int
+        @param offset: The position inside the buffer
+        """
+        self.layout().pack_into(buffer, offset, *self.__getter__(self))
+
+    @classmethod
+    def unpack(cls, buffer, offset=0):
+        """Create a structure from its binary form.
+
+        @param buffer: A string, bytearray or memoryview
+
+        @type  offset: int
+        @param offset: The position inside the buffer
+        """
+        values = cls.layout().unpack_from(buffer, offset)
+        return cls(*_unpad(values, cls.__padded__) if cls.__padded__ else values)
+
+    @classmethod
+    def packMany(cls, records, buffer=None, offset=0):
+        """Pack many structures into a buffer, one after another.
+
+        @type  records: iterable
+        @param records: The structures
+
+        @type  buffer: bytearray
+        @param buffer: A preallocated buffer. If none is given a buffer
+                       fitting all records is created.
+
+        @type  offset: int
+        @param offset: The position of the first record inside the buffer
+
+        @rtype:  bytearray
+        @return: The buffer
+        """
+        layout = cls.layout()
+        if buffer is None:
+            records = records if isinstance(records, (list, tuple)) else list(records)
+            buffer = bytearray(offset + layout.size * len(records))
+        packInto, getter, size = layout.pack_into, cls.__getter__, layout.size
+        for record in records:
+            packInto(buffer, offset, *getter(record))
+            offset += size
+        return buffer
+
+    @classmethod
+    def unpackMany(cls, buffer, count=None, offset=0):
+        """Iterate the structures packed into a buffer.
+        The buffer is read in place, without copying it.
+
+        @param buffer: A string, bytearray or memoryview
+
+        @type  count: int
+        @param count: The number of records, by default the buffer is read
+                      up to its end
+
+        @type  offset: int
+        @param offset: The position of the first record inside the buffer
+        """
+        layout = cls.layout()
+        view = buffer if isinstance(buffer, memoryview) else memoryview(buffer)
+        if count is None:
+            count = (len(view) - offset) // layout.size
+        unpackFrom, size, padded = layout.unpack_from, layout.size, cls.__padded__
+        for idx in xrange(count):
+            if padded:
+                yield cls(*_unpad(unpackFrom(view, offset + idx * size), padded))
+            else:
+                yield cls(*unpackFrom(view, offset + idx * size))
+
     def __eq__(self, other):
         if not isinstance(other, self.__class__):
             return False
@@ -46,9 +285,287 @@ class Structure(object):
         return True
 
 
+class FrozenStructure(Structure):
+    """Immutable and hashable structure.
+
+    All members must be hashable. The hash is computed once, after the
+    initialization. Equal structures can be interned, sharing a single
+    instance.
+    """
+    __slots__ = ['_hashcode', '__weakref__']
+    __frozen__ = True
+
+    def __init__(self, *args, **kwargs):
+        """
+        @param    *args:   Positional arguments
+        @param **kwargs: Keyword arguments
+        """
+        Structure.__init__(self, *args, **kwargs)
+        object.__setattr__(self, '_hashcode', hash(self.__getter__(self)))
+    __init__.__generic__ = True
+
+    def __setattr__(self, name, value):
+        # Members can only be set during the initialization, before the hash is known
+        if hasattr(self, '_hashcode'):
+            raise AttributeError("{} is immutable".format(self.__class__.__name__))
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError("{} is immutable".format(self.__class__.__name__))
+
+    def __reduce__(self):
+        # Recreate the structure through the initializer, the members can't be restored afterwards
+        return (self.__class__, self.__getter__(self))
+
+    def __hash__(self):
+        return self._hashcode
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if other.__class__ is not self.__class__ or self._hashcode != other._hashcode:
+            return False
+        return self.__getter__(self) == other.__getter__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    @classmethod
+    def interned(cls, *args, **kwargs):
+        """Create a structure or return an equal, already interned one.
+        Accepts the same arguments as the constructor.
+
+        @rtype:  FrozenStructure
+        """
+        return cls(*args, **kwargs).intern()
+
+    def intern(self):
+        """Return the interned structure equal to this one.
+        If there is none yet, this structure gets interned.
+        Interned structures are only weakly referenced.
+
+        @rtype:  FrozenStructure
+        """
+        cls = self.__class__
+        if '__interned__' not in cls.__dict__:
+            cls.__interned__ = weakref.WeakValueDictionary()
+        return cls.__interned__.setdefault(self.__getter__(self), self)
+
+
+class StructureRow(object):
+    """Lightweight proxy for a single record inside a `StructureArray`.
+    The members are read from and written to the columns of the array."""
+    __slots__ = ['_array', '_index']
+
+    def __init__(self, array, index):
+        object.__setattr__(self, '_array', array)
+        object.__setattr__(self, '_index', index)
+
+    def __getattr__(self, name):
+        try:
+            return self._array.columns[name][self._index]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name not in self._array.columns:
+            raise AttributeError(name)
+        self._array.columns[name][self._index] = value
+
+    @property
+    def kind(self):
+        return self._array.kind
+
+    def toStructure(self):
+        """Create a real structure from the record.
+
+        @rtype:  Structure
+        """
+        return self._array.kind(*[self._array.columns[name][self._index] for name in self._array.fields])
+
+    def __eq__(self, other):
+        return self.toStructure() == (other.toStructure() if isinstance(other, StructureRow) else other)
+
+    def __repr__(self):
+        return "<{} row {}>".format(self._array.kind.__name__, self._index)
+
+
+class StructureArray(object):
+    """Column-wise storage for a large number of structures of one kind.
+
+    Every member of the structure is stored in its own typed column,
+    according to the `__types__` of the structure.
+    If NumPy is available the columns are NumPy arrays, otherwise the
+    `array` module is used. Members without a type (or typecode 'O') are
+    stored as python objects, like strings of a fixed size without NumPy.
+    """
+
+    def __init__(self, kind, records=(), capacity=16):
+        """
+        @type  kind: type
+        @param kind: The structure class
+
+        @type  records: iterable
+        @param records: Structures to be appended
+
+        @type  capacity: int
+        @param capacity: Initially reserved rows (NumPy only)
+        """
+        self.kind = kind
+        self.fields = list(kind.__slots__)
+        self.types = {name: kind.__types__.get(name, 'O') for name in self.fields}
+        self.length = 0
+        self.columns = {name: self._createColumn(self.types[name], capacity) for name in self.fields}
+        self.extend(records)
+
+    @staticmethod
+    def _createColumn(typecode, capacity):
+        string = typecode[-1:] == 's'
+        if numpy is not None:
+            return numpy.zeros(capacity, dtype=object if typecode == 'O' else "S" + typecode[:-1] if string else typecode)
+        if typecode == 'O' or string:
+            return []
+        return array.array(typecode)
+
+    def _default(self, name):
+        if name in self.kind.__defaults__:
+            return self.kind.__defaults__[name]()
+        if self.types[name][-1:] == 's':
+            return ""
+        return None if self.types[name] == 'O' else 0
+
+    def _reserve(self, count):
+        """Grow the NumPy columns to hold at least *count* rows"""
+        capacity = len(self.columns[self.fields[0]]) if self.fields else count
+        if capacity < count:
+            capacity = max(count, capacity * 2)
+            for name in self.fields:
+                column = numpy.zeros(capacity, dtype=self.columns[name].dtype)
+                column[:self.length] = self.columns[name][:self.length]
+                self.columns[name] = column
+
+    def appendValues(self, *args, **kwargs):
+        """Append a record, given by its members.
+        Accepts the same arguments as the constructor of the structure,
+        without creating a structure. Typed members, that are missing or
+        None, get their default or zero."""
+        values = [kwargs[name] if name in kwargs else args[idx] if idx < len(args) else self._default(name)
+                  for idx, name in enumerate(self.fields)]
+        values = [self._default(name) if value is None and self.types[name] != 'O' else value
+                  for name, value in zip(self.fields, values)]
+        if numpy is not None:
+            self._reserve(self.length + 1)
+            for name, value in zip(self.fields, values):
+                self.columns[name][self.length] = value
+        else:
+            for name, value in zip(self.fields, values):
+                self.columns[name].append(value)
+        self.length += 1
+
+    def append(self, record):
+        """Append a structure.
+
+        @type  record: Structure
+        @param record: The structure
+        """
+        self.appendValues(*[getattr(record, name) for name in self.fields])
+
+    def extend(self, records):
+        """Append many structures.
+
+        @type  records: iterable
+        @param records: The structures
+        """
+        for record in records:
+            self.append(record)
+
+    def column(self, name):
+        """Access a column.
+        Modifications are reflected in the array.
+
+        @type  name: str
+        @param name: The name of the member
+
+        @return: A NumPy array, an array or a list
+        """
+        column = self.columns[name]
+        return column[:self.length] if numpy is not None else column
+
+    def compress(self, mask):
+        """Select rows by a mask.
+
+        @param mask: A sequence of booleans, one per row
+
+        @rtype:  StructureArray
+        @return: A new array with the selected rows
+        """
+        selection = StructureArray(self.kind, capacity=0)
+        for name in self.fields:
+            column = self.column(name)
+            if numpy is not None:
+                selection.columns[name] = column[numpy.asarray(mask, dtype=bool)]
+            elif isinstance(column, list):
+                selection.columns[name] = list(itertools.compress(column, mask))
+            else:
+                selection.columns[name] = array.array(column.typecode, itertools.compress(column, mask))
+        selection.length = len(selection.columns[self.fields[0]]) if self.fields else 0
+        return selection
+
+    def where(self, name, predicate):
+        """Select rows by a predicate on a single column.
+        The predicate is written for a single value. With NumPy it is
+        applied to the whole column at once first, e.g. for simple
+        comparisons like `lambda x: x > 5`. If that does not give a
+        boolean array, it is applied to every value, like without NumPy.
+
+        @type  name: str
+        @param name: The name of the member
+
+        @type  predicate: function
+        @param predicate: The condition
+
+        @rtype:  StructureArray
+        @return: A new array with the selected rows
+        """
+        column = self.column(name)
+        if numpy is not None:
+            try:
+                mask = predicate(column)
+            except (TypeError, ValueError):
+                mask = None
+            if isinstance(mask, numpy.ndarray) and mask.dtype == bool and mask.shape == column.shape:
+                return self.compress(mask)
+        return self.compress([bool(predicate(value)) for value in column])
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for index in xrange(self.length):
+            yield StructureRow(self, index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            selection = StructureArray(self.kind, capacity=0)
+            for name in self.fields:
+                selection.columns[name] = self.column(name)[index]
+                if numpy is not None:
+                    selection.columns[name] = selection.columns[name].copy()
+            selection.length = len(xrange(*index.indices(self.length)))
+            return selection
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return StructureRow(self, index)
+
+    def __repr__(self):
+        return "<StructureArray of {} {}>".format(self.length, self.kind.__name__)
+
+
 class EnumValue(object):
     """Value for an enumeration"""
-    def __init__(self, host, name, value):
+    def __init__(self, host, name, value, index=0):
         """Create a new enumeration value"""
         self.host = host
         """The class hosting this value"""
@@ -56,9 +573,18 @@ class EnumValue(object):
         """Its name"""
         self.value = value
         """Its value"""
+        self.index = index
+        """Its bit position inside an `EnumSet`"""
+
     def __eq__(self, other):
         return other == self.value
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.value)
+
     def __str__(self):
         return "{c.host.__name__}.{c.name}".format(c=self)
 
@@ -70,47 +596,200 @@ class EnumValue(object):
 
 
 class EnumMeta(type):
-    """Metaclass for enumeration creation"""
+    """Metaclass for enumeration creation.
+
+    The lookup tables are built once, when the enumeration is created.
+    """
     def __init__(cls, *args):
-        for member in cls.__dict__:
+        members = []
+        for member in cls.__dict__.keys():
             if not member.startswith("_"):
-                value = getattr(cls, member)
-                setattr(cls, member, EnumValue(cls, member, value))
+                members.append(EnumValue(cls, member, getattr(cls, member)))
+        members.sort(key=lambda m: (m.value, m.name))
+        cls.__members__ = tuple(members)
+        cls.__byName__ = {}
+        cls.__byValue__ = {}
+        cls.__byString__ = {}
+        cls.__toString__ = {}
+        for index, member in enumerate(members):
+            member.index = index
+            setattr(cls, member.name, member)
+            cls.__byName__[member.name] = member
+            cls.__byString__[str(member)] = member
+            try:
+                cls.__byValue__.setdefault(member.value, member)
+                cls.__toString__.setdefault(member.value, str(member))
+            except TypeError:
+                # Unhashable values can only be found by scanning
+                pass
+        cls.__mask__ = (1 << len(members)) - 1
 
     def __repr__(cls):
         """Create the string representation"""
         str = "{}(Enumeration):\n".format(cls.__name__)
         str += '\t"""{}"""\n'.format(cls.__doc__)
-        for member in cls.__dict__:
-            if not member.startswith("_"):
-                val = getattr(cls, member)
-                str += "\t{v.name:} = {v.value:}\n".format(v=val)
+        for val in cls.__members__:
+            str += "\t{v.name:} = {v.value:}\n".format(v=val)
         return str
 
     def __iter__(cls):
-        for member in cls.__dict__:
-            if not member.startswith("_"):
-                yield getattr(cls, member)
+        return iter(cls.__members__)
+
+    def __len__(cls):
+        return len(cls.__members__)
 
     @property
     def items(cls):
-        return [itm for itm in cls]
+        return list(cls.__members__)
 
     @property
     def entries(cls):
-        return {int(itm): itm.name for itm in cls}
+        return {int(itm): itm.name for itm in cls.__members__}
+
+    def fromName(cls, name):
+        """Find a member by its name.
+
+        @type  name: str
+        @param name: The name of the member
+
+        @rtype:  EnumValue
+        @return: The member or None
+        """
+        return cls.__byName__.get(name)
+
+    def fromValue(cls, value):
+        """Find a member by its value. Members with unhashable values are
+        found by scanning all members.
+
+        @param value: The value of the member
+
+        @rtype:  EnumValue
+        @return: The first member with the value or None
+        """
+        try:
+            return cls.__byValue__[value]
+        except KeyError:
+            return None
+        except TypeError:
+            for itm in cls.__members__:
+                if value == itm.value:
+                    return itm
 
     def fromString(cls, s):
-        for itm in cls:
-            if s == str(itm):
-                return itm
+        return cls.__byString__.get(s)
 
     def toString(cls, i):
-        for itm in cls:
-            if i == itm.value:
+        try:
+            return cls.__toString__.get(i)
+        except TypeError:
+            itm = cls.fromValue(i)
+            if itm is not None:
                 return str(itm)
 
+    def set(cls, *members):
+        """Create a set of members of this enumeration.
+
+        @rtype:  EnumSet
+        """
+        return EnumSet(cls, members)
+
 
 class Enumeration(object):
     """An enumeration like object"""
     __metaclass__ = EnumMeta
+
+
+class EnumSet(object):
+    """A set of members of an enumeration, packed into the bits of an
+    integer. Set operations are single integer operations.
+
+    Instances are immutable and hashable:
+
+        colors = Color.set(Color.Red, Color.Blue)
+        if Color.Red in colors: ...
+        colors | Color.set(Color.Green)
+    """
+    __slots__ = ['enum', 'mask']
+
+    def __init__(self, enum, members=(), mask=0):
+        """
+        @type  enum: EnumMeta
+        @param enum: The enumeration
+
+        @type  members: iterable
+        @param members: The members, either as `EnumValue` or by their value
+
+        @type  mask: int
+        @param mask: The initial bit mask
+        """
+        for member in members:
+            mask |= 1 << enum.__byValue__[member].index
+        self.enum = enum
+        self.mask = mask
+
+    def _other(self, other):
+        if not isinstance(other, EnumSet) or other.enum is not self.enum:
+            raise TypeError("Can't combine {!r} with {!r}".format(self, other))
+        return other.mask
+
+    def __or__(self, other):
+        return EnumSet(self.enum, mask=self.mask | self._other(other))
+
+    def __and__(self, other):
+        return EnumSet(self.enum, mask=self.mask & self._other(other))
+
+    def __sub__(self, other):
+        return EnumSet(self.enum, mask=self.mask & ~self._other(other))
+
+    def __xor__(self, other):
+        return EnumSet(self.enum, mask=self.mask ^ self._other(other))
+
+    def __invert__(self):
+        return EnumSet(self.enum, mask=~self.mask & self.enum.__mask__)
+
+    def __le__(self, other):
+        return self.mask & ~self._other(other) == 0
+
+    def __ge__(self, other):
+        return self._other(other) & ~self.mask == 0
+
+    def __lt__(self, other):
+        return self <= other and self.mask != other.mask
+
+    def __gt__(self, other):
+        return self >= other and self.mask != other.mask
+
+    def __contains__(self, member):
+        if not isinstance(member, EnumValue) or member.host is not self.enum:
+            member = self.enum.__byValue__.get(member)
+        return member is not None and bool(self.mask >> member.index & 1)
+
+    def __iter__(self):
+        mask = self.mask
+        for member in self.enum.__members__:
+            if mask == 0:
+                break
+            if mask & 1:
+                yield member
+            mask >>= 1
+
+    def __len__(self):
+        return bin(self.mask).count("1")
+
+    def __nonzero__(self):
+        return self.mask != 0
+
+    def __int__(self):
+        return self.mask
+
+    def __eq__(self, other):
+        return isinstance(other, EnumSet) and other.enum is self.enum and other.mask == self.mask
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.enum, self.mask))
+
+    def __repr__(self):
+        return "{}.set({})".format(self.enum.__name__, ", ".join(member.name for member in self))
@@ -30,6 +30,7 @@ from plugin import PluginMount
 from shortcut import ShortcutBuilder
 from menu import MenuBuilder
 from event import SkipEvent, EventBase
+from watcher import PluginReloadEvent
 
 
 class DuplicateViewNameError(Exception):
@@ -183,6 +184,7 @@ class ViewBuilder(CoreWindowObject, ShortcutBuilder):
         """
         CoreWindowObject.__init__(self, *args, **kwargs)
         self._created = False
+        self._frame = None
         if self.__class__.name == ViewBuilder.name:
             self.__class__.name = self.__class__.__name__
 
@@ -245,6 +247,7 @@ class ViewBuilder(CoreWindowObject, ShortcutBuilder):
         PerspectiveLoadEvent.addHandler(self.loadPerspective, 'fname')
         PerspectiveSaveEvent.addHandler(self.savePerspective, 'fname')
         PerspectiveResetEvent.addHandler(self.resetPerspective)
+        PluginReloadEvent.addHandler(self.reloadView, 'old', 'new')
 
         logger.info("Trying to load the default perspective")
         if os.path.exists("default.perspective"):
@@ -272,6 +275,18 @@ class ViewBuilder(CoreWindowObject, ShortcutBuilder):
             logger.debug("Can't close tab[{}] '{}'".format(tabIdx, self.tabs.GetPageText(tabIdx)))
         event.Veto()
 
+    def destroyView(self):
+        """Release a view, before it is replaced by a reloaded one or
+        removed. Views adding event handlers of their own remove them here,
+        the default closes the window of a floating view.
+
+        @type  self: ViewBuilder
+        @param self: The ViewBuilder instance
+        """
+        if self._frame:
+            self._frame.Destroy()
+        self._frame = None
+
     def updateView(self):
         """If called from the hook update all views.
 
@@ -283,6 +298,66 @@ class ViewBuilder(CoreWindowObject, ShortcutBuilder):
                 if view._created:
                     view.updateView()
 
+    def reloadView(self, old, new):
+        """Eventhandler for PluginReloadEvent
+        Replaces the instance of a reloaded view and recreates its tab or
+        its floating window, leaving all other views untouched. Like in
+        `createView`, views without a tab are not packed until they are
+        shown.
+
+        @type  self: ViewBuilder
+        @param self: The ViewBuilder instance
+
+        @type  old: type
+        @param old: The class of the reloaded view, None for a new view
+
+        @type  new: type
+        @param new: The new class of the view, None for a removed view
+        """
+        assert self.isMount()
+        if not wx.IsMainThread():
+            wx.CallAfter(self.reloadView, old, new)
+            return
+        if not any(plug is not None and issubclass(plug, ViewBuilder) for plug in (old, new)):
+            return
+        views = OrderedDict()
+        reloaded = None
+        tabIdx = None
+        floating = False
+        for name, view in self.views.iteritems():
+            if view.__class__ is not old:
+                views[name] = view
+                continue
+            for idx in xrange(self.tabs.GetPageCount()):
+                if self.tabs.GetPageText(idx) == view.Title:
+                    tabIdx = idx
+                    self.tabs.DeletePage(idx)
+                    break
+            floating = bool(view._frame)
+            view.destroyView()
+            if new is not None:
+                logger.info("Reloading view '{}'".format(view.Title))
+                reloaded = new(self.windowHandle, self.coreRef)
+                views[reloaded.name] = reloaded
+        if old is None and new is not None:
+            reloaded = new(self.windowHandle, self.coreRef)
+            if reloaded.name in views:
+                raise DuplicateViewNameError(reloaded.name)
+            views[reloaded.name] = reloaded
+            if reloaded.Title != "" and reloaded.Title != ViewBuilder.Title and not reloaded.Floating:
+                tabIdx = self.tabs.GetPageCount()
+        self.views = views
+        if reloaded is not None and (reloaded.Title in ("", ViewBuilder.Title) or reloaded.Floating):
+            # A shown view stays visible as a window
+            if reloaded.Floating and (floating or tabIdx is not None):
+                self.showView(name=reloaded.name)
+        elif reloaded is not None and tabIdx is not None:
+            content = self.packContent(self.tabs, view=reloaded)
+            self.tabs.InsertPage(tabIdx, content, reloaded.Title)
+            self.tabs.SetCloseButton(tabIdx, reloaded.Closeable)
+        self.registerShortcuts([view for view in self.views.itervalues()])
+        PerspectiveTabCloseEvent.fire()
+
     def loadPerspective(self, fname):
         """Eventhandler for PerspectiveLoadEvent
 
@@ -395,6 +470,7 @@ class ViewBuilder(CoreWindowObject, ShortcutBuilder):
             raise TypeError("Neither an Index nor a Name was given to identify the view")
         if view.Floating:
             frame = self.showAsWindow(view=view)
+            view._frame = frame
             frame.CentreOnScreen()
             frame.Show()
             frame.Refresh()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Jelly Watcher - Hot plugin reloading
+
+Watches the plugin folder (see `plugin.createPluginsFolder`) for changed
+modules. A changed module gets reloaded and the plugins defined inside are
+swapped in their mounts.
+
+A module failing to reload leaves the plugins untouched, the classes it
+defined before the failure are dropped.
+
+For every swapped plugin a `PluginReloadEvent` is fired, allowing the mounts
+to re-instantiate only the affected plugins.
+
+Watching in the background (see `PluginWatcher.start`) needs a dispatcher,
+running the reloads in the thread owning the mounts, e.g. `wx.CallAfter`.
+
+If `pyinotify` is available, the watcher is notified by the kernel.
+Otherwise the folder is polled, by comparing the modification times of its
+modules.
+"""
+
+import os
+import sys
+import threading
+
+import logging
+# We are assuming, that there is an already configured logger present
+logger = logging.getLogger(__name__)
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# other jelly modules
+from plugin import PluginMount, TaxonomyPluginMount, snapshotRegistries, restoreRegistries
+from event import EventBase
+
+
+class PluginReloadEvent(EventBase):
+    """A plugin was reloaded.
+    A newly added plugin has no *old* class, a removed plugin no *new*
+    class."""
+    __slots__ = ['mount', 'old', 'new']
+
+
+def getMount(plugin):
+    """Find the hook class of a plugin class.
+
+    @type  plugin: type
+    @param plugin: The plugin class
+
+    @rtype:  type
+    @return: The mount or None, if the class is not a plugin
+    """
+    for clazz in plugin.__mro__:
+        if clazz is not plugin and ('plugins' in clazz.__dict__ or 'taxonomy' in clazz.__dict__):
+            return clazz
+    return None
+
+
+def getPlugins(module):
+    """Collect all plugin classes defined in a module.
+
+    @type  module: module
+    @param module: The module
+
+    @rtype:  dict
+    @return: The plugin classes by their name
+    """
+    plugins = {}
+    for name, member in vars(module).iteritems():
+        if isinstance(member, (PluginMount, TaxonomyPluginMount)) and member.__module__ == module.__name__:
+            if getMount(member) is not None:
+                plugins[name] = member
+            else:
+                logger.warning("Mount {} in module {} can't be reloaded".format(name, module.__name__))
+    return plugins
+
+
+class PluginWatcher(object):
+    """Watches the plugin folder and reloads changed modules."""
+
+    def __init__(self, dirname='plugins', package=None, interval=1.0, dispatch=None):
+        """
+        @type  dirname: str
+        @param dirname: The plugin folder
+
+        @type  package: str
+        @param package: The package name of the plugin folder.
+                        Defaults to the name of the folder.
+
+        @type  interval: float
+        @param interval: Seconds between two polls, if inotify is not
+                         available
+
+        @param dispatch: A callable used to run the reloads found in the
+                         background, e.g. `wx.CallAfter` to reload inside
+                         the main loop. Needed by `start`.
+        """
+        self.dirname = dirname
+        self.package = package if package is not None else os.path.basename(os.path.abspath(dirname))
+        self.interval = interval
+        self.dispatch = dispatch
+        self.mtimes = self.scan()
+        self._stop = threading.Event()
+        self._thread = None
+        self._notifier = None
+
+    def scan(self):
+        """Collect the modification times of all modules in the folder.
+
+        @rtype:  dict
+        @return: The modification time for every module name
+        """
+        mtimes = {}
+        for fname in os.listdir(self.dirname):
+            if fname == '__init__.py' or fname[-3:] != '.py':
+                continue
+            try:
+                mtimes[fname[:-3]] = os.stat(os.path.join(self.dirname, fname)).st_mtime
+            except OSError:
+                pass
+        return mtimes
+
+    def changes(self):
+        """Compare the folder with the last known state.
+
+        @rtype:  tuple
+        @return: The names of the changed (and added) and removed modules
+        """
+        mtimes = self.scan()
+        changed = [name for name, mtime in mtimes.iteritems() if self.mtimes.get(name) != mtime]
+        removed = [name for name in self.mtimes if name not in mtimes]
+        self.mtimes = mtimes
+        return changed, removed
+
+    def check(self):
+        """Poll the folder once and reload all changed modules.
+
+        @rtype:  list
+        @return: The names of the reloaded modules
+        """
+        changed, removed = self.changes()
+        self.apply(changed, removed)
+        return changed + removed
+
+    def apply(self, changed, removed=()):
+        """Reload changed modules and drop the plugins of removed modules.
+
+        @type  changed: list
+        @param changed: Names of changed or added modules
+
+        @type  removed: list
+        @param removed: Names of removed modules
+        """
+        for name in changed:
+            try:
+                self.reloadModule(name)
+            except Exception:
+                logger.exception("Reloading plugin module '{}' failed".format(name))
+        for name in removed:
+            self.removeModule(name)
+
+    def reloadModule(self, name):
+        """(Re-)Import a plugin module and swap its plugins.
+        If the module fails, the plugins and the module are restored.
+
+        @type  name: str
+        @param name: The module name, relative to the plugin package
+        """
+        fqname = ".".join((self.package, name))
+        module = sys.modules.get(fqname)
+        snapshot = snapshotRegistries()
+        if module is None:
+            logger.info("Loading plugin module {}".format(fqname))
+            try:
+                __import__(fqname)
+            except Exception:
+                restoreRegistries(snapshot)
+                raise
+            for plugin in getPlugins(sys.modules[fqname]).itervalues():
+                PluginReloadEvent.fire(getMount(plugin), None, plugin)
+            return
+        logger.info("Reloading plugin module {}".format(fqname))
+        old = getPlugins(module)
+        namespace = dict(module.__dict__)
+        try:
+            new = getPlugins(reload(module))
+        except Exception:
+            # Drop the classes defined before the failure
+            restoreRegistries(snapshot)
+            module.__dict__.clear()
+            module.__dict__.update(namespace)
+            raise
+        for key, plugin in old.iteritems():
+            mount = getMount(plugin)
+            if key in new:
+                mount.replacePlugin(plugin, new[key])
+            else:
+                mount.unregisterPlugin(plugin)
+            PluginReloadEvent.fire(mount, plugin, new.get(key))
+        for key, plugin in new.iteritems():
+            if key not in old:
+                PluginReloadEvent.fire(getMount(plugin), None, plugin)
+
+    def removeModule(self, name):
+        """Drop all plugins of a removed module.
+
+        @type  name: str
+        @param name: The module name, relative to the plugin package
+        """
+        fqname = ".".join((self.package, name))
+        module = sys.modules.pop(fqname, None)
+        if module is None:
+            return
+        logger.info("Removing plugin module {}".format(fqname))
+        for plugin in getPlugins(module).itervalues():
+            mount = getMount(plugin)
+            mount.unregisterPlugin(plugin)
+            PluginReloadEvent.fire(mount, plugin, None)
+
+    def start(self):
+        """Start watching the folder in the background.
+        The reloads are handed to the dispatcher, since the plugins and
+        views must not be swapped while the main thread uses them.
+
+        @raise ValueError: The watcher has no dispatcher
+        """
+        if self.dispatch is None:
+            raise ValueError("Watching in the background needs a dispatcher, e.g. wx.CallAfter")
+        self._stop.clear()
+        if pyinotify is not None:
+            watcher = self
+
+            class Handler(pyinotify.ProcessEvent):
+                def process_default(self, event):
+                    if event.name.endswith(".py"):
+                        watcher.notify()
+
+            manager = pyinotify.WatchManager()
+            mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE
+            manager.add_watch(self.dirname, mask)
+            self._notifier = pyinotify.ThreadedNotifier(manager, Handler())
+            self._notifier.daemon = True
+            self._notifier.start()
+        else:
+            self._thread = threading.Thread(target=self.poll, name="PluginWatcher")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop watching the folder."""
+        self._stop.set()
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def notify(self):
+        """Hand all pending changes to the dispatcher."""
+        changed, removed = self.changes()
+        if len(changed) > 0 or len(removed) > 0:
+            self.dispatch(self.apply, changed, removed)
+
+    def poll(self):
+        """Polling loop, if inotify is not available."""
+        while not self._stop.wait(self.interval):
+            self.notify()